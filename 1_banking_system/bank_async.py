@@ -0,0 +1,122 @@
+# bank_async.py
+# asyncio serving mode for dist_bank.py (enabled with --async, needs aiohttp).
+# One event loop thread runs both:
+#   - an aiohttp front end that accepts connections and hands each request to the Flask
+#     app (WSGI) on a thread pool, so idle keep-alive connections cost no threads
+#   - an aiohttp client used for peer fan-outs: every call in a fan-out is in flight at
+#     once, each bounded by its own deadline, so a fan-out takes as long as the slowest
+#     healthy peer instead of the sum over all peers
+
+import asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+# hop-by-hop / framing headers aiohttp computes itself
+_SKIP_HEADERS = {"content-length", "transfer-encoding", "connection"}
+
+def call_wsgi(app, environ):
+    """
+    Run one request through a WSGI app. Returns (status code, headers, body, chunks):
+    a response with a Content-Length is read whole into body (chunks is None); a streamed
+    one (no length, e.g. /log) is left unread as the WSGI iterable chunks, for the caller to
+    send on as it is produced and then close_wsgi().
+    """
+    app_iter, status, headers = run_wsgi_app(app, environ)
+    code = int(status.split(" ", 1)[0])
+    headers_out = [(k, v) for k, v in headers if k.lower() not in _SKIP_HEADERS]
+    if "Content-Length" not in headers:
+        return code, headers_out, None, app_iter
+    try:
+        body = b"".join(app_iter)
+    finally:
+        close_wsgi(app_iter)
+    return code, headers_out, body, None
+
+def close_wsgi(app_iter):
+    if hasattr(app_iter, "close"):
+        app_iter.close()
+
+class AsyncRuntime:
+    """Event loop thread shared by the aiohttp server and the aiohttp peer client."""
+
+    def __init__(self, workers=64):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session = self.call(self.open_session())
+
+    async def open_session(self):
+        # no connection cap: a fan-out must never queue behind another peer's slow call
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+
+    def call(self, coro):
+        """Run a coroutine on the loop from any other thread and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    # client side
+
+    def fan_out(self, method, calls, timeout):
+        """Blocking wrapper around gather_calls() for the node's worker threads."""
+        return self.call(self.gather_calls(method, calls, timeout))
+
+    async def gather_calls(self, method, calls, timeout):
+        return await asyncio.gather(*(self.one_call(method, url, body, timeout) for url, body in calls))
+
+    async def one_call(self, method, url, body, timeout):
+        """(status, text) for one request, or None if it failed or missed its deadline."""
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)}
+        if hasattr(body, "headers"):
+            # bank_codec.Encoded: a pre-encoded body that brings its own content headers
+            kwargs.update(data=bytes(body), headers=body.headers)
+        elif isinstance(body, (str, bytes)):
+            kwargs.update(data=body, headers={"Content-Type": "application/json"})
+        elif body is not None:
+            kwargs["json"] = body
+        try:
+            async with self.session.request(method, url, **kwargs) as r:
+                return r.status, await r.text()
+        except Exception:
+            return None
+
+    # server side
+
+    def serve(self, app, host, port):
+        """Serve `app` on host:port until the process exits."""
+        self.call(self.start_server(app, host, port))
+        self.thread.join()
+
+    async def start_server(self, app, host, port):
+        runner = web.ServerRunner(web.Server(lambda request: self.handle(app, request)))
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+    async def handle(self, app, request):
+        body = await request.read()
+        environ = EnvironBuilder(
+            path=request.path, method=request.method, query_string=request.query_string,
+            headers=[(k, v) for k, v in request.headers.items() if k.lower() != "content-length"],
+            data=body).get_environ()
+        if request.remote:
+            environ["REMOTE_ADDR"] = request.remote
+        status, headers, body, chunks = await self.loop.run_in_executor(self.executor, call_wsgi, app, environ)
+        if chunks is None:
+            return web.Response(status=status, headers=headers, body=body)
+        # streamed: pull the next chunk on the pool and write it out before asking for more,
+        # so a long /log holds one chunk in memory rather than the whole response
+        response = web.StreamResponse(status=status, headers=headers)
+        parts = iter(chunks)
+        try:
+            await response.prepare(request)
+            while True:
+                chunk = await self.loop.run_in_executor(self.executor, next, parts, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+            await response.write_eof()
+        finally:
+            await self.loop.run_in_executor(self.executor, close_wsgi, chunks)
+        return response
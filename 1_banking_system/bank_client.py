@@ -0,0 +1,130 @@
+# bank_client.py
+# Cluster-aware client for dist_bank.py nodes.
+# Writes go straight to the leader, which is cached and re-discovered when it moves (a 307
+# leader hint from a follower, an X-Leader header on a proxied reply, a refused connection,
+# or a 503 during an election). Every transfer carries a client_txid, so retrying after a
+# timeout is safe: the cluster answers a repeat with the original result. Reads are spread
+# round-robin over all nodes.
+#
+# from bank_client import BankClient
+# bank = BankClient(["http://127.0.0.1:5001", "http://127.0.0.1:5002", "http://127.0.0.1:5003"])
+# bank.transfer("A", "B", 10)
+# bank.balance("B", consistency="linearizable")
+
+import itertools, threading, time, uuid
+import requests
+
+class ClusterUnavailable(Exception):
+    """No leader could be reached before the call's deadline."""
+
+def json_reply(r):
+    """The JSON body of a response, or None if it has none (e.g. an error page from a proxy)."""
+    if "json" not in r.headers.get("Content-Type", ""):
+        return None
+    try:
+        return r.json()
+    except ValueError:
+        return None
+
+class BankClient:
+
+    def __init__(self, nodes, timeout=2.0, deadline=10.0, pool=32):
+        self.nodes = list(nodes)
+        self.timeout = timeout      # per HTTP request
+        self.deadline = deadline    # per call, across retries and leader changes
+        self.leader = None
+        self.lock = threading.Lock()
+        self.readers = itertools.cycle(self.nodes)
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=len(self.nodes),
+                                                                     pool_maxsize=pool))
+
+    def find_leader(self):
+        """Ask the nodes who leads; returns its URL or None."""
+        for node in self.nodes:
+            try:
+                jd = self.session.get(node + "/status", timeout=self.timeout).json()
+            except Exception:
+                continue
+            if jd.get("is_leader"):
+                return node
+            if jd.get("leader"):
+                return jd["leader"]
+        return None
+
+    def current_leader(self):
+        with self.lock:
+            if self.leader is None:
+                self.leader = self.find_leader()
+            return self.leader
+
+    def forget_leader(self, hint=None):
+        with self.lock:
+            self.leader = hint
+
+    def post(self, path, body):
+        """POST a write to the leader, following leader hints and retrying until the deadline."""
+        end = time.time() + self.deadline
+        backoff = 0.05
+        last = None
+        while time.time() < end:
+            leader = self.current_leader()
+            if leader is not None:
+                try:
+                    r = self.session.post(leader + path, json=body, timeout=self.timeout, allow_redirects=False)
+                    reply = json_reply(r)
+                    if r.status_code == 307:
+                        self.forget_leader((reply or {}).get("leader"))
+                        continue
+                    if reply is None and r.status_code < 500:
+                        return {"status": "error", "code": r.status_code, "message": r.text}
+                    # a 503, or a 5xx that is not ours (a proxy's error page): retry
+                    if r.status_code != 503 and reply is not None:
+                        if r.headers.get("X-Leader"):
+                            # a follower proxied this for us; go direct next time
+                            self.forget_leader(r.headers["X-Leader"])
+                        return reply
+                    last = reply or r.text
+                except requests.RequestException as e:
+                    last = e
+                self.forget_leader()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 0.5)
+        raise ClusterUnavailable(f"no leader reachable within {self.deadline}s (last reply: {last})")
+
+    def transfer(self, src, dst, amount, client_txid=None):
+        return self.post("/transaction", {"from": src, "to": dst, "amount": amount,
+                                          "client_txid": client_txid or uuid.uuid4().hex})
+
+    def transfers(self, transfers):
+        """Submit many transfers in one request; transfers without a client_txid get one."""
+        batch = [dict(t, client_txid=t.get("client_txid") or uuid.uuid4().hex) for t in transfers]
+        return self.post("/transactions", {"transfers": batch})
+
+    def balances(self, accounts, consistency="stale", **bounds):
+        """Read from the next node in turn; bounds are max_lag= and/or min_seq=."""
+        params = dict(bounds, accounts=",".join(accounts), consistency=consistency)
+        last = None
+        for _ in range(len(self.nodes)):
+            node = next(self.readers)
+            try:
+                r = self.session.get(node + "/balances", params=params, timeout=self.timeout)
+                if r.status_code == 200:
+                    return r.json()["balances"]
+                last = r.text
+            except (requests.RequestException, ValueError) as e:
+                last = e
+        raise ClusterUnavailable(f"no node could serve the read: {last}")
+
+    def balance(self, account, consistency="stale", **bounds):
+        return self.balances([account], consistency, **bounds)[account]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", default="http://127.0.0.1:5001,http://127.0.0.1:5002,http://127.0.0.1:5003")
+    args = parser.parse_args()
+    bank = BankClient(args.nodes.split(","))
+    print("leader:", bank.current_leader())
+    print(bank.transfer("A", "B", 10))
+    print({a: bank.balance(a, consistency="linearizable") for a in ("A", "B", "C")})
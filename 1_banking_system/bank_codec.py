@@ -0,0 +1,175 @@
+# bank_codec.py
+# Wire codecs for node-to-node traffic of dist_bank.py (/commit, /install_snapshot,
+# /snapshot and /log). A message is a dict of plain fields plus one list of log
+# entries under `key` ("entries" for /commit, "log" elsewhere); both codecs round-trip the
+# same dict, so handlers do not care which one a peer used.
+#
+# json    application/json, the dict as is (what every node understands)
+# binary  application/x-bank-entries:
+#           b"BNK1" <fields_len:u32> <fields as JSON, plus "_key">
+#           <n_strings:u32> <byte lengths:u32 * n_strings> <utf-8 bytes of every string>
+#           <n_entries:u32> <fixed 49-byte record per entry>
+#         A record is <seq:i64><term:i64><lamport:i64><amount:i64><from:u32><to:u32><txid:u32><xid:u32><flags:u8>
+#         where from/to/txid/xid index the string table (NONE when absent), so an account
+#         name is sent once per message instead of once per entry, and a float amount is
+#         stored as its IEEE bits with FLAG_FLOAT_AMOUNT.
+# Any body larger than the compression threshold goes out zlib-compressed with
+# Content-Encoding: deflate.
+#
+# /log streams binary as frames: <length:u32><flags:u8><message>, FRAME_DEFLATE in flags when
+# the message is compressed. The first frame carries the log header and no entries.
+
+import json, struct, zlib
+from array import array
+
+JSON_TYPE = "application/json"
+BINARY_TYPE = "application/x-bank-entries"
+
+MAGIC = b"BNK2"  # BNK1 records had no term
+_U32 = struct.Struct("<I")
+_RECORD = struct.Struct("<qqqqIIIIB")
+_FRAME = struct.Struct("<IB")
+_DOUBLE = struct.Struct("<d")
+_LONG = struct.Struct("<q")
+NONE = 0xFFFFFFFF
+FLAG_FLOAT_AMOUNT = 1
+FRAME_DEFLATE = 1
+
+class Encoded(bytes):
+    """An encoded request body that carries the headers it must be sent with."""
+
+    def __new__(cls, body, headers):
+        obj = super().__new__(cls, body)
+        obj.headers = headers
+        return obj
+
+def encode_binary(fields, entries, key="entries"):
+    strings = {}
+    intern = lambda s: strings.setdefault(s, len(strings))
+    pack = _RECORD.pack
+    records = bytearray()
+    for e in entries:
+        amount = e['amount']
+        flags = 0
+        if isinstance(amount, float):
+            flags = FLAG_FLOAT_AMOUNT
+            amount, = _LONG.unpack(_DOUBLE.pack(amount))
+        txid = e.get('client_txid')
+        xid = e.get('xid')
+        records += pack(e['seq'], e.get('term', 0), e.get('lamport', 0), amount, intern(e['from']), intern(e['to']),
+                        NONE if txid is None else intern(txid),
+                        NONE if xid is None else intern(xid), flags)
+    encoded = [s.encode() for s in strings]
+    header = json.dumps(dict(fields, _key=key)).encode()
+    return b"".join((MAGIC, _U32.pack(len(header)), header,
+                     _U32.pack(len(encoded)), array('I', map(len, encoded)).tobytes(), *encoded,
+                     _U32.pack(len(records) // _RECORD.size), records))
+
+def decode_binary(body):
+    buf = memoryview(body)
+    if bytes(buf[:4]) != MAGIC:
+        raise ValueError("not a binary bank message")
+    pos = 4
+    n, = _U32.unpack_from(buf, pos)
+    fields = json.loads(bytes(buf[pos + 4:pos + 4 + n]))
+    pos += 4 + n
+    n, = _U32.unpack_from(buf, pos)
+    lengths = array('I')
+    lengths.frombytes(buf[pos + 4:pos + 4 + 4 * n])
+    pos += 4 + 4 * n
+    blob = bytes(buf[pos:pos + sum(lengths)])
+    pos += len(blob)
+    strings = []
+    if blob.isascii():
+        # byte offsets are character offsets: decode once and slice
+        text, start = blob.decode(), 0
+        for length in lengths:
+            strings.append(text[start:start + length])
+            start += length
+    else:
+        start = 0
+        for length in lengths:
+            strings.append(blob[start:start + length].decode())
+            start += length
+    n, = _U32.unpack_from(buf, pos)
+    pos += 4
+    strings.append(None)  # NONE (0xFFFFFFFF) is out of range; map it explicitly below
+    last = len(strings) - 1
+    entries = []
+    for seq, term, lamport, amount, src, dst, txid, xid, flags in _RECORD.iter_unpack(buf[pos:pos + n * _RECORD.size]):
+        if flags & FLAG_FLOAT_AMOUNT:
+            amount, = _DOUBLE.unpack(_LONG.pack(amount))
+        e = {"seq": seq, "term": term, "lamport": lamport, "from": strings[src], "to": strings[dst], "amount": amount,
+             "client_txid": strings[last if txid == NONE else txid]}
+        if xid != NONE:
+            e["xid"] = strings[xid]
+        entries.append(e)
+    key = fields.pop("_key")
+    fields[key] = entries
+    return fields
+
+def encode_json(fields, entries, key="entries"):
+    return json.dumps(dict(fields, **{key: list(entries)})).encode()
+
+def decode_json(body):
+    return json.loads(body)
+
+CODECS = {"json": (JSON_TYPE, encode_json), "binary": (BINARY_TYPE, encode_binary)}
+
+class UnsupportedCodec(ValueError):
+    """The body's content type is neither codec's."""
+
+def encode_message(codec, fields, entries, key="entries", compress_min=None):
+    """Encoded body for `codec` ("json" or "binary"), deflated when longer than compress_min bytes."""
+    content_type, encoder = CODECS[codec]
+    body = encoder(fields, entries, key)
+    headers = {"Content-Type": content_type}
+    if compress_min is not None and len(body) > compress_min:
+        body = zlib.compress(body, 1)
+        headers["Content-Encoding"] = "deflate"
+    return Encoded(body, headers)
+
+def decode_message(body, content_type, content_encoding=None):
+    """The message dict from a body of either codec; UnsupportedCodec for an unknown content type."""
+    if content_encoding == "deflate":
+        body = zlib.decompress(body)
+    content_type = (content_type or "").split(";")[0].strip()
+    if content_type == BINARY_TYPE:
+        return decode_binary(body)
+    if content_type == JSON_TYPE:
+        return decode_json(body)
+    raise UnsupportedCodec(f"unsupported content type {content_type!r}")
+
+def frame(fields, entries, compress_min=None):
+    """One length-prefixed binary frame of a /log stream."""
+    message = encode_binary(fields, entries, "log")
+    flags = 0
+    if compress_min is not None and len(message) > compress_min:
+        message = zlib.compress(message, 1)
+        flags = FRAME_DEFLATE
+    return _FRAME.pack(len(message), flags) + message
+
+def read_exact(stream, n):
+    """n bytes from `stream`, or fewer if it ends first."""
+    chunks = []
+    while n > 0:
+        chunk = stream.read(n)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def read_frames(stream):
+    """Messages of a framed /log stream, read from a file-like `stream` until it ends."""
+    while True:
+        head = read_exact(stream, _FRAME.size)
+        if len(head) < _FRAME.size:
+            return
+        length, flags = _FRAME.unpack(head)
+        message = read_exact(stream, length)
+        if len(message) < length:
+            return
+        if flags & FRAME_DEFLATE:
+            message = zlib.decompress(message)
+        yield decode_binary(message)
@@ -0,0 +1,227 @@
+# bank_metrics.py
+# Instrumentation for dist_bank.py nodes, served at /metrics in the Prometheus text format
+# (version 0.0.4), plus an on-demand sampling profiler for /debug/profile.
+# Deliberately dependency-free: counters, gauges and histograms are plain dicts behind a
+# lock, and gauges whose value lives elsewhere in the node are read at scrape time through
+# a callback instead of being updated on the hot path.
+
+import sys, threading, time
+from bisect import bisect_left
+from collections import Counter as Tally
+
+# seconds; wide enough for a loopback RTT and a slow quorum commit alike
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# lock waits are mostly zero or microseconds
+LOCK_BUCKETS = (0.000001, 0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(n + '="' + escape(v) + '"' for n, v in zip(names, values)) + "}"
+
+def format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Registry:
+    """Every metric of the process, rendered in registration order."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=(), registry=REGISTRY):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, format_labels(self.labelnames, key), value
+
+class Gauge:
+    """
+    A value set by the node, or read at scrape time from `fn`. `fn` returns a number for an
+    unlabelled gauge, or {label values tuple: number} for a labelled one.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), fn=None, registry=REGISTRY):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.fn = fn
+        self.values = {}
+        registry.register(self)
+
+    def set(self, value, **labels):
+        self.values[tuple(labels[n] for n in self.labelnames)] = value
+
+    def samples(self):
+        if self.fn is None:
+            values = dict(self.values)
+        else:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            yield self.name, format_labels(self.labelnames, key), value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}    # label values -> [per-bucket counts (+Inf last), sum]
+        self.lock = threading.Lock()
+        self.zero_sources = {}  # label values -> objects whose .free counts zero observations
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        self.observe_key(tuple(labels[n] for n in self.labelnames), value)
+
+    def observe_key(self, key, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def child(self, **labels):
+        """observe() bound to fixed labels, for hot paths."""
+        key = tuple(labels[n] for n in self.labelnames)
+        return lambda value: self.observe_key(key, value)
+
+    def count_zeros(self, source, **labels):
+        """Include `source.free` (a count of observations of 0 kept by the caller) at scrape time."""
+        key = tuple(labels[n] for n in self.labelnames)
+        with self.lock:
+            self.zero_sources.setdefault(key, []).append(source)
+            self.series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+            zero_sources = {key: list(sources) for key, sources in self.zero_sources.items()}
+        for key, counts, total in items:
+            counts[0] += sum(source.free for source in zero_sources.get(key, ()))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                yield (self.name + "_bucket",
+                       format_labels(self.labelnames + ("le",), key + (format_value(bound),)), cumulative)
+            yield self.name + "_sum", format_labels(self.labelnames, key), total
+            yield self.name + "_count", format_labels(self.labelnames, key), cumulative
+
+class TimedLock:
+    """
+    A threading.Lock that records how long each acquirer waited in `histogram`. Uncontended
+    acquisitions only bump `free`, under the lock just taken, and reach the histogram's
+    lowest bucket at scrape time; only real waits pay for a histogram update.
+    """
+
+    def __init__(self, histogram, **labels):
+        self.lock = threading.Lock()
+        self.observe = histogram.child(**labels)
+        self.free = 0
+        histogram.count_zeros(self, **labels)
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.free += 1
+            return True
+        if not blocking:
+            return False
+        t0 = time.perf_counter()
+        ok = self.lock.acquire(True, timeout)
+        self.observe(time.perf_counter() - t0)
+        return ok
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+# innermost Python frames of a thread parked in a blocking call (lock, queue, socket wait)
+IDLE_FRAMES = {("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker"),
+               ("selectors.py", "select"), ("socket.py", "readinto"), ("socket.py", "accept"),
+               ("socketserver.py", "serve_forever")}
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in the process every `interval` seconds, only while a
+    capture runs, so it costs nothing the rest of the time. Output is the folded format
+    ("thread;outer;...;inner count" per line) read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.busy = threading.Lock()
+
+    def capture(self, seconds, interval=0.005, idle=True):
+        """
+        Profile for `seconds`; returns folded stacks, or None if a capture is already running.
+        idle=False drops samples of threads parked in IDLE_FRAMES, leaving the busy paths.
+        """
+        if not self.busy.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            stacks = Tally()
+            end = time.time() + seconds
+            while time.time() < end:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    code = frame.f_code
+                    if not idle and (code.co_filename.rsplit('/', 1)[-1], code.co_name) in IDLE_FRAMES:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+            return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+        finally:
+            self.busy.release()
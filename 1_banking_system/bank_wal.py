@@ -0,0 +1,209 @@
+# bank_wal.py
+# Append-only write-ahead log of committed entries for dist_bank.py.
+# Appends only encode and buffer; a flusher thread writes and fsyncs everything buffered
+# once per sync interval (group commit), so one fsync covers many entries.
+#
+# Files in the data directory:
+#   snapshot.json  {"seq": n, "term": t, "balances": {...}, "lamport": l}  balances after
+#                  applying seq n (an entry of term t) and the node's Lamport clock then
+#                  (atomic rename)
+#   wal.log        binary records of entries applied after the snapshot
+#   term.json      {"term": t}  the highest leader term the node has seen, so a restart
+#                  never takes part in a term twice (atomic rename)
+
+import os, json, mmap, struct, threading, time, zlib
+
+# Record: <payload_len:u32><crc32:u32><payload>
+# Payload: <seq:i64><lamport:i64><flags:u8><amount:i64|f64><from_len:u16><to_len:u16><txid_len:u16>
+#          followed by the utf-8 bytes of from, to and client_txid,
+#          then <xid_len:u16> and the xid bytes when FLAG_HAS_XID is set (cross-shard entries),
+#          then <term:i64> when FLAG_HAS_TERM is set (records written before terms have none: 0)
+_HEADER = struct.Struct("<II")
+_FIXED = struct.Struct("<qqB")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_LENS = struct.Struct("<HHH")
+_XID_LEN = struct.Struct("<H")
+
+FLAG_FLOAT_AMOUNT = 1
+FLAG_HAS_TXID = 2
+FLAG_HAS_XID = 4
+FLAG_HAS_TERM = 8
+
+def encode_entry(entry):
+    """Binary record for one log entry."""
+    flags = FLAG_HAS_TERM
+    amount = entry['amount']
+    if isinstance(amount, float):
+        flags |= FLAG_FLOAT_AMOUNT
+    txid = entry.get('client_txid')
+    if txid is not None:
+        flags |= FLAG_HAS_TXID
+        txid = txid.encode()
+    else:
+        txid = b""
+    xid = entry.get('xid')
+    if xid is not None:
+        flags |= FLAG_HAS_XID
+        xid = xid.encode()
+        xid = _XID_LEN.pack(len(xid)) + xid
+    else:
+        xid = b""
+    src = entry['from'].encode()
+    dst = entry['to'].encode()
+    payload = b"".join((
+        _FIXED.pack(entry['seq'], entry.get('lamport', 0), flags),
+        (_FLOAT if flags & FLAG_FLOAT_AMOUNT else _INT).pack(amount),
+        _LENS.pack(len(src), len(dst), len(txid)),
+        src, dst, txid, xid, _INT.pack(entry.get('term', 0))
+    ))
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def decode_entry(buf, offset, length):
+    """Entry dict from the payload at buf[offset:offset+length]."""
+    seq, lamport, flags = _FIXED.unpack_from(buf, offset)
+    pos = offset + _FIXED.size
+    amount, = (_FLOAT if flags & FLAG_FLOAT_AMOUNT else _INT).unpack_from(buf, pos)
+    pos += 8
+    src_len, dst_len, txid_len = _LENS.unpack_from(buf, pos)
+    pos += _LENS.size
+    src = bytes(buf[pos:pos + src_len]).decode()
+    pos += src_len
+    dst = bytes(buf[pos:pos + dst_len]).decode()
+    pos += dst_len
+    txid = bytes(buf[pos:pos + txid_len]).decode() if flags & FLAG_HAS_TXID else None
+    pos += txid_len
+    entry = {"seq": seq, "term": 0, "lamport": lamport, "from": src, "to": dst, "amount": amount, "client_txid": txid}
+    if flags & FLAG_HAS_XID:
+        xid_len, = _XID_LEN.unpack_from(buf, pos)
+        pos += _XID_LEN.size
+        entry['xid'] = bytes(buf[pos:pos + xid_len]).decode()
+        pos += xid_len
+    if flags & FLAG_HAS_TERM:
+        entry['term'], = _INT.unpack_from(buf, pos)
+    return entry
+
+class WriteAheadLog:
+    """
+    Durable log for one node. append() is cheap and never blocks on disk; entries become
+    durable at the next group fsync, at most `sync_interval` seconds later.
+    """
+
+    def __init__(self, directory, sync_interval=0.01):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "wal.log")
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.term_path = os.path.join(directory, "term.json")
+        self.term = 0                      # highest term saved so far
+        self.sync_interval = sync_interval
+        self.buffer = []                   # encoded records not yet written
+        self.lock = threading.Lock()       # guards buffer
+        self.io_lock = threading.Lock()    # serializes file writes, fsyncs and truncation
+        self.file = None
+        self.closed = False
+
+    def recover(self):
+        """
+        Read snapshot.json and replay wal.log through mmap. Returns (snapshot, entries), with
+        snapshot None on a fresh directory. A torn or corrupt tail record is truncated away.
+        """
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        entries = []
+        good = 0
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                size = len(buf)
+                while good + _HEADER.size <= size:
+                    length, crc = _HEADER.unpack_from(buf, good)
+                    start = good + _HEADER.size
+                    if start + length > size or zlib.crc32(buf[start:start + length]) != crc:
+                        break
+                    entries.append(decode_entry(buf, start, length))
+                    good = start + length
+            if good < os.path.getsize(self.path):
+                with open(self.path, "r+b") as f:
+                    f.truncate(good)
+        if snapshot is not None:
+            entries = [e for e in entries if e['seq'] > snapshot['seq']]
+        return snapshot, entries
+
+    def load_term(self):
+        """The term last saved with save_term(), 0 on a fresh directory."""
+        if os.path.exists(self.term_path):
+            with open(self.term_path) as f:
+                self.term = max(self.term, json.load(f)["term"])
+        return self.term
+
+    def save_term(self, term):
+        """Durably record `term` if it is higher than any saved before; returns once it is on disk."""
+        if term <= self.term:
+            return
+        tmp = self.term_path + ".tmp"
+        with self.io_lock:
+            if term <= self.term:
+                return
+            with open(tmp, "w") as f:
+                json.dump({"term": term}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.term_path)
+            self.term = term
+
+    def start(self):
+        """Open the log for appending and start the group-commit flusher."""
+        self.file = open(self.path, "ab")
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def append(self, entry):
+        record = encode_entry(entry)
+        with self.lock:
+            self.buffer.append(record)
+
+    def extend(self, entries):
+        records = [encode_entry(e) for e in entries]
+        with self.lock:
+            self.buffer.extend(records)
+
+    def flush(self):
+        """Write everything buffered so far and fsync it."""
+        with self.io_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+            if records and self.file is not None:
+                self.file.write(b"".join(records))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def checkpoint(self, seq, balances, lamport=0, term=0):
+        """
+        Persist `balances` as the state after `seq` and empty the log. The caller must hold
+        the lock that orders appends (log_lock), so every buffered record is covered.
+        `lamport` is kept so a restart's clock stays ahead of the entries the log dropped,
+        `term` (of the entry at `seq`) so the node can still tell whose log it holds.
+        """
+        tmp = self.snapshot_path + ".tmp"
+        with self.io_lock:
+            with open(tmp, "w") as f:
+                json.dump({"seq": seq, "term": term, "balances": balances, "lamport": lamport}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            with self.lock:
+                self.buffer = []
+            if self.file is not None:
+                self.file.truncate(0)
+                os.fsync(self.file.fileno())
+            else:
+                open(self.path, "wb").close()
+
+    def run(self):
+        while not self.closed:
+            time.sleep(self.sync_interval)
+            self.flush()
+
+    def close(self):
+        self.closed = True
+        self.flush()
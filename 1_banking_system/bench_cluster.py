@@ -0,0 +1,267 @@
+# bench_cluster.py
+# Load generator and failover benchmark for a local dist_bank.py cluster.
+# Launches --nodes nodes on loopback ports, drives transfers through bank_client.BankClient
+# for --duration seconds and prints the results as JSON:
+#   - throughput and p50/p99/p999 latency of acknowledged transfers
+#   - with --kill-leader-at, the leader is SIGKILLed that many seconds into the run; the
+#     failover section reports the longest stretch without an acknowledged transfer, the time until
+#     throughput is back to 90% of its pre-kill rate, and the nodes' own failover timings
+#   - whether every surviving node agrees on the balances and their total is conserved, and
+#     whether each account moved by exactly the acknowledged transfers (a transfer whose
+#     outcome the client never learned may or may not have been applied)
+#
+# Closed loop: --clients workers each send their next transfer when the last one is answered.
+# Open loop: transfers are scheduled at --rate per second regardless of how fast they are
+# answered (--clients bounds the concurrency); latency counts from the scheduled time, so a
+# stall shows up as latency instead of silently lowering the offered load.
+#
+# python3 bench_cluster.py --nodes 3 --clients 16 --duration 20 --kill-leader-at 8
+# python3 bench_cluster.py --mode open --rate 500 --duration 20 --out results.json
+# Extra node flags go through --node-args, e.g. --node-args "--acks leader --async"
+
+import argparse, json, os, queue, shlex, subprocess, sys, tempfile, threading, time, uuid
+import requests
+from bank_client import BankClient, ClusterUnavailable
+
+def start_cluster(script, n, base_port, node_args, log_dir):
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(n)]
+    procs = []
+    os.makedirs(log_dir, exist_ok=True)
+    for i, url in enumerate(urls):
+        peers = ",".join(u for u in urls if u != url)
+        log = open(os.path.join(log_dir, f"node{i + 1}.log"), "w")
+        procs.append(subprocess.Popen([sys.executable, script, "--id", str(i + 1), "--port", str(base_port + i),
+                                       "--peers", peers, *node_args],
+                                      cwd=os.path.dirname(os.path.abspath(script)),
+                                      stdout=log, stderr=subprocess.STDOUT))
+    return urls, procs
+
+def status(url, timeout=1.0):
+    try:
+        return requests.get(url + "/status", timeout=timeout).json()
+    except Exception:
+        return None
+
+def wait_leader(urls, timeout=30.0):
+    """URL of the node that reports itself leader once every node agrees on it."""
+    end = time.time() + timeout
+    while time.time() < end:
+        states = [s for s in map(status, urls) if s]
+        leaders = {s["leader"] for s in states}
+        if len(states) == len(urls) and len(leaders) == 1 and any(s["is_leader"] for s in states):
+            return leaders.pop()
+        time.sleep(0.1)
+    raise SystemExit("no leader elected")
+
+def wait_settled(urls, timeout=10.0):
+    """Statuses of `urls` once they report the same applied balances (or whatever they say at the timeout)."""
+    end = time.time() + timeout
+    while True:
+        states = {u: status(u) for u in urls}
+        live = {u: s for u, s in states.items() if s}
+        if live and len({json.dumps(s["balances"], sort_keys=True) for s in live.values()}) == 1:
+            return live
+        if time.time() > end:
+            return live
+        time.sleep(0.2)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class Recorder:
+    """
+    (scheduled or sent time, done time, ok) of every transfer, appended from worker threads,
+    plus the net amount acknowledged transfers moved per account and, for transfers with no
+    definite answer, how far they could have moved each account down (low) or up (high).
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.moved = {}
+        self.low = {}
+        self.high = {}
+        self.lock = threading.Lock()
+
+    def add(self, start, done, ok, src=None, dst=None, amount=0, unknown=False):
+        with self.lock:
+            self.samples.append((start, done, ok))
+            if ok:
+                self.moved[src] = self.moved.get(src, 0) - amount
+                self.moved[dst] = self.moved.get(dst, 0) + amount
+            elif unknown:
+                self.low[src] = self.low.get(src, 0) - amount
+                self.high[dst] = self.high.get(dst, 0) + amount
+
+def send(bank, accounts, i, recorder, start):
+    src = accounts[i % len(accounts)]
+    dst = accounts[(i + 1) % len(accounts)]
+    unknown = False
+    try:
+        ok = bank.transfer(src, dst, 1, client_txid=uuid.uuid4().hex).get("status") == "committed"
+    except (ClusterUnavailable, ValueError):
+        ok, unknown = False, True
+    recorder.add(start, time.time(), ok, src, dst, 1, unknown)
+
+def check_balances(initial, settled, recorder):
+    """
+    Per node, the accounts whose balance is not the initial one plus the acknowledged
+    transfers, give or take transfers that ended without a definite answer.
+    """
+    wrong = {}
+    for url, s in settled.items():
+        for account in set(initial) | set(s["balances"]):
+            off = s["balances"].get(account, 0) - initial.get(account, 0) - recorder.moved.get(account, 0)
+            if not recorder.low.get(account, 0) <= off <= recorder.high.get(account, 0):
+                wrong.setdefault(url, {})[account] = off
+    return wrong
+
+def closed_loop(bank, accounts, args, recorder, stop):
+    def worker(idx):
+        i = idx
+        while not stop.is_set():
+            send(bank, accounts, i, recorder, time.time())
+            i += args.clients
+    return [threading.Thread(target=worker, args=(idx,)) for idx in range(args.clients)]
+
+def open_loop(bank, accounts, args, recorder, stop):
+    due = queue.Queue()
+
+    def scheduler():
+        t0 = time.time()
+        i = 0
+        while not stop.is_set():
+            at = t0 + i / args.rate
+            delay = at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            due.put((i, at))
+            i += 1
+        for _ in range(args.clients):
+            due.put(None)
+
+    def worker():
+        while True:
+            item = due.get()
+            if item is None:
+                return
+            i, at = item
+            send(bank, accounts, i, recorder, at)
+
+    return [threading.Thread(target=scheduler)] + [threading.Thread(target=worker) for _ in range(args.clients)]
+
+def failover_report(samples, t0, killed_at, bin_size=0.25):
+    """
+    The longest stretch after the kill with no transfer acknowledged (replies already in
+    flight at the kill can land just after it), and the time until throughput recovered.
+    """
+    acked = sorted(done for _, done, ok in samples if ok)
+    after = [d for d in acked if d > killed_at]
+    points = [killed_at] + after
+    gap = max((b - a for a, b in zip(points, points[1:])), default=None)
+    before = [d for d in acked if t0 + 1.0 <= d <= killed_at]   # skip the first second (warm-up)
+    baseline = len(before) / max(killed_at - t0 - 1.0, bin_size)
+    recovered = None
+    t = killed_at
+    while after and t < after[-1]:
+        n = sum(1 for d in after if t <= d < t + bin_size)
+        if n / bin_size >= 0.9 * baseline:
+            recovered = t + bin_size - killed_at
+            break
+        t += bin_size
+    return {"gap_ms": round(gap * 1000, 1) if gap is not None else None,
+            "recovery_ms": round(recovered * 1000, 1) if recovered is not None else None,
+            "baseline_tx_s": round(baseline, 1)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist_bank.py"))
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=5801)
+    parser.add_argument("--node-args", default="", help="extra flags for every node, one quoted string")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--clients", type=int, default=16, help="closed: concurrent clients; open: max in flight")
+    parser.add_argument("--rate", type=float, default=500.0, help="open loop: transfers scheduled per second")
+    parser.add_argument("--accounts", default="A,B,C", help="accounts transfers move money between")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--kill-leader-at", type=float, default=None, help="seconds into the run; off by default")
+    parser.add_argument("--timeout", type=float, default=2.0, help="per-request timeout of the client")
+    parser.add_argument("--deadline", type=float, default=10.0, help="per-transfer deadline across retries")
+    parser.add_argument("--log-dir", default=None, help="node logs (default: a temporary directory)")
+    parser.add_argument("--out", default=None, help="write the JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="bench_cluster_")
+    urls, procs = start_cluster(args.script, args.nodes, args.base_port, shlex.split(args.node_args), log_dir)
+    try:
+        leader = wait_leader(urls)
+        time.sleep(1.0)  # let reconciliation and the first heartbeats settle
+        initial = status(leader)["balances"]
+        expected = sum(initial.values())
+        accounts = args.accounts.split(",")
+        bank = BankClient(urls, timeout=args.timeout, deadline=args.deadline, pool=args.clients)
+        recorder = Recorder()
+        stop = threading.Event()
+        make = closed_loop if args.mode == "closed" else open_loop
+        threads = make(bank, accounts, args, recorder, stop)
+
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        killed = killed_at = None
+        if args.kill_leader_at is not None:
+            time.sleep(args.kill_leader_at)
+            killed, killed_at = leader, time.time()
+            procs[urls.index(leader)].kill()
+        time.sleep(max(0.0, t0 + args.duration - time.time()))
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+
+        survivors = [u for u in urls if u != killed]
+        settled = wait_settled(survivors)
+        totals = {u: sum(s["balances"].values()) for u, s in settled.items()}
+        wrong = check_balances(initial, settled, recorder)
+        samples = recorder.samples
+        latencies = sorted(done - start for start, done, ok in samples if ok)
+        ok = len(latencies)
+        result = {
+            "config": {"nodes": args.nodes, "mode": args.mode, "clients": args.clients,
+                       "rate": args.rate if args.mode == "open" else None, "duration_s": args.duration,
+                       "accounts": accounts, "node_args": args.node_args, "kill_leader_at_s": args.kill_leader_at},
+            "transfers": {"acknowledged": ok, "failed": len(samples) - ok},
+            "throughput_tx_s": round(ok / elapsed, 1),
+            "latency_ms": {"p50": percentile(latencies, 0.50), "p99": percentile(latencies, 0.99),
+                           "p999": percentile(latencies, 0.999), "max": latencies[-1] if latencies else None,
+                           "mean": sum(latencies) / ok if ok else None},
+            "conservation": {"expected_total": expected, "totals": totals,
+                             "nodes_agree": len({json.dumps(s["balances"], sort_keys=True) for s in settled.values()}) == 1,
+                             "conserved": bool(totals) and all(t == expected for t in totals.values())},
+            "balances": {"initial": initial, "acknowledged_moves": recorder.moved,
+                         "unknown_outcome": {"low": recorder.low, "high": recorder.high},
+                         "unexplained": wrong, "match": bool(settled) and not wrong},
+            "log_dir": log_dir,
+        }
+        result["latency_ms"] = {k: round(v * 1000, 2) if v is not None else None for k, v in result["latency_ms"].items()}
+        if killed:
+            report = failover_report(samples, t0, killed_at)
+            new_leader = next((s["leader"] for s in settled.values() if s.get("leader")), None)
+            report.update(killed=killed, new_leader=new_leader,
+                          node_reported=next((s["last_failover"] for s in settled.values() if s.get("last_failover")), None))
+            result["failover"] = report
+        text = json.dumps(result, indent=2)
+        print(text)
+        if args.out:
+            with open(args.out, "w") as f:
+                f.write(text + "\n")
+        if not result["conservation"]["conserved"] or not result["balances"]["match"]:
+            sys.exit(1)
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# bench_codec.py
+# Wire codec benchmark (bank_codec.py): bytes on the wire and encode/decode CPU for the JSON
+# and binary codecs, each with and without deflate, on replication-shaped messages.
+#
+# python3 bench_codec.py                      (1k, 100k and 1M entries)
+# python3 bench_codec.py --sizes 1000,50000 --accounts 1000
+
+import argparse, time, uuid
+from bank_codec import encode_message, decode_message
+
+def make_entries(n, accounts):
+    return [{"seq": seq, "term": 1, "lamport": seq * 2, "from": f"acct{seq % accounts}",
+             "to": f"acct{(seq * 7 + 1) % accounts}", "amount": seq % 50 + 1,
+             "client_txid": uuid.uuid4().hex} for seq in range(1, n + 1)]
+
+def timed(fn, repeat):
+    """Best wall time of `repeat` runs, and the last result."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--accounts", type=int, default=100)
+    args = parser.parse_args()
+    fields = {"term": 3, "leader": "http://127.0.0.1:5003", "commit": 0}
+    print(f"{'entries':>8} {'codec':<14} {'bytes':>12} {'B/entry':>8} {'encode s':>9} {'decode s':>9}")
+    for n in map(int, args.sizes.split(",")):
+        entries = make_entries(n, args.accounts)
+        repeat = 5 if n <= 100000 else 1
+        for codec in ("json", "binary"):
+            for compress in (False, True):
+                compress_min = 0 if compress else None
+                enc_time, body = timed(lambda: encode_message(codec, fields, entries, "entries", compress_min), repeat)
+                dec_time, message = timed(lambda: decode_message(bytes(body), body.headers["Content-Type"],
+                                                                 body.headers.get("Content-Encoding")), repeat)
+                assert message["entries"] == entries, f"{codec} round trip changed the entries"
+                name = codec + ("+deflate" if compress else "")
+                print(f"{n:>8} {name:<14} {len(body):>12} {len(body) / n:>8.1f} {enc_time:>9.3f} {dec_time:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# bench_contention.py
+# Contention benchmark for dist_bank.py: runs a single-node cluster (it is its own leader)
+# and hammers /transaction from many concurrent clients while other clients poll /status
+# and tails /log, then reports throughput and checks that the balance total is conserved.
+#
+# python3 bench_contention.py --clients 32 --readers 8 --duration 10
+# Compare against another version of the node with --script old_dist_bank.py
+# --inproc drives the node's Flask app through its test client instead of real sockets,
+# which takes HTTP parsing and client CPU out of the picture and isolates lock contention.
+
+import argparse, importlib.util, os, subprocess, sys, threading, time
+import requests
+
+class TestClientSession:
+    """Just enough of requests.Session on top of a Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, url, json=None, timeout=None):
+        return TestClientResponse(self.client.post(url, json=json))
+
+    def get(self, url, timeout=None):
+        return TestClientResponse(self.client.get(url))
+
+class TestClientResponse:
+    def __init__(self, resp):
+        self.status_code = resp.status_code
+        self.resp = resp
+
+    def json(self):
+        return self.resp.get_json()
+
+def load_node(script):
+    """Import a dist_bank.py as a module and make it a seeded, peerless leader."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    spec = importlib.util.spec_from_file_location("bench_node", script)
+    node = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(node)
+    node.NODE_ID, node.PORT, node.IS_LEADER = 1, 0, True
+    node.reconciled_term = getattr(node, "term", None)  # no takeover to wait for
+    node.seed_demo_accounts()
+    return node
+
+def start_node(script, port):
+    node = subprocess.Popen([sys.executable, script, "--id", "1", "--port", str(port)],
+                            cwd=os.path.dirname(os.path.abspath(script)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    end = time.time() + 15.0
+    while time.time() < end:
+        try:
+            if requests.get(base + "/status", timeout=0.5).json().get("is_leader"):
+                return node, base
+        except Exception:
+            pass
+        time.sleep(0.2)
+    node.kill()
+    raise SystemExit("node did not become leader")
+
+def writer(session, base, accounts, stop, counts, idx):
+    n = 0
+    i = idx
+    while not stop.is_set():
+        src = accounts[i % len(accounts)]
+        dst = accounts[(i + 1) % len(accounts)]
+        i += 7
+        try:
+            r = session.post(base + "/transaction", json={"from": src, "to": dst, "amount": 1}, timeout=5.0)
+            if r.status_code == 200:
+                n += 1
+        except Exception:
+            pass
+    counts[idx] = n
+
+def reader(session, base, stop, counts, idx):
+    """Alternate /status with a /log request for the last 100 entries."""
+    n = 0
+    tail = 0
+    while not stop.is_set():
+        try:
+            if n % 2:
+                session.get(base + f"/log?since={tail}", timeout=5.0)
+            else:
+                tail = max(0, session.get(base + "/status", timeout=5.0).json()["seq_counter"] - 100)
+            n += 1
+        except Exception:
+            pass
+    counts[idx] = n
+
+def run(args, base, new_session):
+    accounts = [f"acct{i}" for i in range(args.accounts)]
+    stop = threading.Event()
+    wcounts = [0] * args.clients
+    rcounts = [0] * args.readers
+    threads = [threading.Thread(target=writer, args=(new_session(), base, accounts, stop, wcounts, i))
+               for i in range(args.clients)]
+    threads += [threading.Thread(target=reader, args=(new_session(), base, stop, rcounts, i))
+                for i in range(args.readers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    total = sum(new_session().get(base + "/status", timeout=5.0).json()["balances"].values())
+    print(f"script:       {args.script}{' (in-process)' if args.inproc else ''}")
+    print(f"clients:      {args.clients} writers, {args.readers} readers, {args.accounts} accounts")
+    print(f"transactions: {sum(wcounts)} ({sum(wcounts) / args.duration:.0f} tx/s)")
+    print(f"reads:        {sum(rcounts)} ({sum(rcounts) / args.duration:.0f} req/s)")
+    print(f"balance sum:  {total}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "dist_bank.py"))
+    parser.add_argument("--port", type=int, default=5901)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--accounts", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--inproc", action="store_true", help="drive the app in-process via its test client")
+    args = parser.parse_args()
+
+    if args.inproc:
+        app = load_node(args.script).app
+        run(args, "", lambda: TestClientSession(app))
+        return
+    node, base = start_node(args.script, args.port)
+    try:
+        run(args, base, requests.Session)
+    finally:
+        node.kill()
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,20 @@
 # Run multiple instances to simulate servers. Uses Flask and requests.
 # pip install flask requests
 
-from flask import Flask, request, jsonify
-import threading, requests, time, argparse, sys
-from collections import defaultdict
-import json
+from flask import Flask, request, jsonify, Response
+import threading, requests, time, argparse, sys, queue, zlib, uuid
+from collections import defaultdict, OrderedDict, deque
+from itertools import count
+from operator import itemgetter
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import json, math
+import atexit
+
+from bank_wal import WriteAheadLog
+from bank_columns import ColumnarLog, Interner
+from bank_codec import BINARY_TYPE, Encoded, UnsupportedCodec, encode_message, decode_message, frame, read_frames
+from bank_metrics import REGISTRY, LOCK_BUCKETS, Counter, Gauge, Histogram, TimedLock, SamplingProfiler
 
 app = Flask(__name__)
 
@@ -16,68 +26,1047 @@ PEERS = []  # list of peer base URLs, e.g. http://127.0.0.1:5002
 LEADER = None  # leader base URL, e.g. http://127.0.0.1:5003
 IS_LEADER = False
 
+class LamportClock:
+    """Lamport clock; ticks and merges update the counter under one lock."""
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def tick(self):
+        with self.lock:
+            self.value += 1
+            return self.value
+
+    def merge(self, received):
+        with self.lock:
+            self.value = max(self.value, received) + 1
+            return self.value
+
+    def peek(self):
+        return self.value
+
 # Logical (Lamport) clock
-lamport = 0
-lamport_lock = threading.Lock()
+clock = LamportClock()
 
-# Global sequence counter (only meaningful for leader)
+# Global sequence counter (only meaningful for leader); assigned under log_lock
 seq_counter = 1
-seq_lock = threading.Lock()
 
-# Transaction log: list of dicts {seq, lamport, from, to, amount, client_txid}
-transaction_log = []
-log_lock = threading.Lock()
+class TransactionLog:
+    """
+    Committed entries keyed by seq.
+    `entries` is the applied prefix in seq order, stored column-wise (bank_columns.ColumnarLog;
+    append-only, and reset and compaction swap in a new store, so a reader holding a view never
+    sees it change underneath). Entries that arrive ahead of a gap wait in `pending` as dicts
+    until the missing seqs show up.
+    `snapshot` holds the balances as of snapshot["seq"] (and the term of the entry there);
+    entries it covers may be truncated.
+    Every entry carries the term of the leader that wrote it, so two logs holding the same
+    (seq, term) agree up to that seq.
+    """
+
+    def __init__(self):
+        self.names = Interner()                # account ids shared by every store we swap in
+        self.entries = ColumnarLog(self.names) # applied entries in seq order
+        self.pending = {}      # seq -> entry received out of order
+        self.pending_term = 0  # term of the leader whose batches `pending` came from
+        self.applied_seq = 0   # highest seq of the contiguous applied prefix
+        self.snapshot = {"seq": 0, "balances": {}}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, seq):
+        return seq in self.pending or self.entries.has(seq)
+
+    def add(self, entry):
+        """Insert an entry; return the entries that became applicable, in seq order."""
+        seq = entry['seq']
+        if seq <= self.applied_seq or seq in self.pending:
+            return []
+        if seq != self.applied_seq + 1:
+            self.pending[seq] = entry
+            return []
+        ready = [entry]
+        nxt = seq + 1
+        while nxt in self.pending:
+            ready.append(self.pending.pop(nxt))
+            nxt += 1
+        self.entries.extend(ready)
+        self.applied_seq = ready[-1]['seq']
+        return ready
+
+    def reset(self, entries):
+        """
+        Replace the applied prefix with `entries` (sorted by seq, no duplicates; or a
+        ColumnarLog over our names, taken as is) without applying them. Returns pending
+        entries that now follow on and must be applied.
+        """
+        store = entries
+        if not isinstance(store, ColumnarLog):
+            store = ColumnarLog(self.names)
+            store.extend(entries)
+        self.entries = store
+        self.applied_seq = max(self.snapshot['seq'], store.last_seq())
+        pending, self.pending = self.pending, {}
+        ready = []
+        for seq in sorted(pending):
+            ready.extend(self.add(pending[seq]))
+        return ready
+
+    def drop_pending(self):
+        """
+        Discard the entries buffered past a gap (they came from a leader that has since been
+        replaced, or are about to be overwritten). Returns what was dropped.
+        """
+        dropped = list(self.pending.values())
+        self.pending = {}
+        return dropped
+
+    def term_at(self, seq):
+        """Term of the entry at `seq` (0 before the first one), or None if we hold no such entry."""
+        if seq in self.pending:
+            return self.pending[seq].get('term', 0)
+        found = self.entries.term_of(seq)
+        if found is not None:
+            return found
+        if seq == self.snapshot['seq']:
+            return self.snapshot.get('term', 0)
+        return 0 if seq == 0 else None
+
+    def last_term(self):
+        return self.term_at(self.applied_seq)
+
+    def install(self, snapshot, entries):
+        """Adopt a snapshot plus the entries retained after it; same contract as reset()."""
+        self.snapshot = snapshot
+        return self.reset(entries)
+
+    def compact(self, balances_now, retain=0):
+        """
+        Snapshot `balances_now` (the balances after applied_seq) and drop entries more than
+        `retain` seqs behind it, so slightly lagging followers can still replay from the log.
+        """
+        self.snapshot = {"seq": self.applied_seq, "term": self.term_at(self.applied_seq), "balances": balances_now}
+        cut = self.entries.bisect(self.applied_seq - retain)
+        if cut:
+            self.entries = self.entries.tail(cut)
+
+    def first_seq(self):
+        """Lowest seq still held in the log."""
+        return self.entries.seqs[0] if self.entries else self.applied_seq + 1
+
+    def view(self):
+        """Entry dicts of the applied prefix as of now; safe to consume outside log_lock."""
+        entries = self.entries
+        return entries.dicts(0, len(entries))
+
+    def since(self, seq):
+        """Like view(), but only entries with a seq greater than `seq`."""
+        entries = self.entries
+        return entries.dicts(entries.bisect(seq), len(entries))
+
+    def records(self):
+        """LogRecord views of the applied prefix, for in-process scans that need no dicts."""
+        entries = self.entries
+        return entries.records(0, len(entries))
+
+    def net_flows_since(self, seq):
+        """{account: net amount moved in} by applied entries with a seq greater than `seq`."""
+        entries = self.entries
+        return entries.net_flows(entries.bisect(seq))
+
+# Metrics served at /metrics; gauges over node state are registered next to it
+commit_latency = Histogram("bank_commit_latency_seconds",
+                           "Leader: time from a write arriving to its acknowledgement", labels=("endpoint",))
+entries_applied = Counter("bank_entries_applied_total", "Log entries applied to balances")
+elections = Counter("bank_elections_total", "Elections this node ran, by outcome", labels=("outcome",))
+election_duration = Histogram("bank_election_duration_seconds", "Time from starting an election to a leader")
+heartbeat_rtt = Histogram("bank_heartbeat_rtt_seconds", "Leader: /heartbeat round trip", labels=("follower",))
+replication_rtt = Histogram("bank_replication_rtt_seconds", "Leader: /commit batch round trip", labels=("follower",))
+lock_wait = Histogram("bank_lock_wait_seconds", "Time spent waiting to acquire a lock", labels=("lock",),
+                      buckets=LOCK_BUCKETS)
+profiler = SamplingProfiler()
+PROFILING = False  # /debug/profile available; off unless started with --profiling
+PROFILE_MAX_SECONDS = 30.0  # longest capture one request can ask for
+
+# Transaction log: entries are dicts {seq, term, lamport, from, to, amount, client_txid} on the way
+# in and out, columns in between
+transaction_log = TransactionLog()
+log_lock = TimedLock(lock_wait, lock="log_lock")
+
+class Balances:
+    """
+    Account balances with copy-on-write reads. Writers already run one at a time under
+    log_lock (entries are applied in seq order), so `lock` only keeps a reader from seeing
+    half of a transfer: a transfer lands both sides with one dict.update under it.
+    snapshot() caches a copy per version, so /status readers take no lock and never block
+    committers.
+    `seq` is the highest log seq whose effects are fully in `data` (entries are applied in
+    seq order), so a reader that samples it before reading sees at least that state.
+    """
+
+    def __init__(self, lock=None):
+        self.data = {}
+        self.lock = lock or threading.Lock()
+        self.versions = count(1)
+        self.version = 0
+        self.cached = (0, {})    # (version, read-only copy)
+        self.seq = 0
+
+    def move(self, src, dst, amount, seq=None):
+        """Debit src and credit dst (either may be None when we own only one side)."""
+        with self.lock:
+            change = {}
+            if src is not None:
+                change[src] = self.data.get(src, 0) - amount
+            if dst is not None:
+                change[dst] = change.get(dst, self.data.get(dst, 0)) + amount
+            self.data.update(change)
+            self.version = next(self.versions)
+            if seq is not None:
+                self.seq = seq
+
+    def read(self, accounts):
+        """Balances of `accounts` at one instant."""
+        with self.lock:
+            return {a: self.data.get(a, 0) for a in accounts}
+
+    def replace(self, mapping, merge=False, seq=None):
+        """Swap in new balances wholesale (or overwrite just the given accounts with merge=True)."""
+        with self.lock:
+            self.data = {**self.data, **mapping} if merge else dict(mapping)
+            self.version = next(self.versions)
+            if seq is not None:
+                self.seq = seq
+
+    def snapshot(self):
+        """Consistent read-only copy of all balances; callers must not mutate it."""
+        version = self.version
+        cached_version, cached = self.cached
+        if cached_version == version:
+            return cached
+        copy = dict(self.data)
+        self.cached = (version, copy)
+        return copy
 
 # Balances
-balances = defaultdict(int)
-balances_lock = threading.Lock()
+balances = Balances(TimedLock(lock_wait, lock="balances"))
+
+class TxidCache:
+    """
+    Idempotency index: client_txid -> the committed entry carrying it. Bounded to `capacity`
+    txids (least recently used evicted first); lookups ignore txids older than `ttl` seconds.
+    Every node fills it as entries are applied, so it travels with the log to followers.
+    """
+
+    def __init__(self, capacity, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.items = OrderedDict()  # txid -> (entry, time indexed), least recently used first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, txid):
+        """The committed entry for `txid`, or None if unknown or expired."""
+        with self.lock:
+            item = self.items.get(txid)
+            if item is None:
+                return None
+            if self.ttl and time.time() - item[1] > self.ttl:
+                del self.items[txid]
+                return None
+            self.items.move_to_end(txid)
+            return item[0]
+
+    def add(self, entries):
+        now = time.time()
+        with self.lock:
+            for e in entries:
+                txid = e.get('client_txid')
+                if txid is not None:
+                    self.items[txid] = (e, now)
+                    self.items.move_to_end(txid)
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+            # drop expired txids at the cold end while we are here
+            while self.ttl and self.items and now - next(iter(self.items.values()))[1] > self.ttl:
+                self.items.popitem(last=False)
 
-# For heartbeat monitoring
-last_leader_heartbeat = time.time()
-HEARTBEAT_INTERVAL = 1.0
-HEARTBEAT_TIMEOUT = 3.0
+    def forget(self, entries):
+        """Unindex the txids of `entries` (overwritten by a new leader's log), unless a later entry holds them."""
+        with self.lock:
+            for e in entries:
+                txid = e.get('client_txid')
+                item = self.items.get(txid) if txid is not None else None
+                if item is not None and item[0]['seq'] == e['seq']:
+                    del self.items[txid]
+
+# Idempotent retries (overridable via --txid-memory / --txid-ttl)
+TXID_MEMORY = 100000  # client txids remembered
+TXID_TTL = 600.0      # seconds a client txid is honoured
+txids = TxidCache(TXID_MEMORY, TXID_TTL)
+transfers_inflight = {}  # client_txid -> Event set when the cross-shard attempt holding it ends
+transfers_lock = threading.Lock()
+
+# Sharding (multi-leader mode, enabled with --shard-config / --shard). Accounts are
+# hash-partitioned; each shard is its own cluster with its own leader, seq and log, and
+# a node only holds balances for accounts its shard owns.
+SHARDS = []            # index = shard id, value = list of node base URLs
+SHARD = None           # our shard id; None means unsharded (we own every account)
+shard_leaders = {}     # shard id -> last node that answered as its leader
+shard_session = requests.Session()
+prepared = OrderedDict()  # xid -> (transfer, time) we voted yes on, awaiting the coordinator's decision
+prepared_lock = threading.Lock()
+PREPARE_TTL = 60.0     # seconds a prepared transfer waits for its decision before it is forgotten
+applied_xids = OrderedDict()  # xid -> seq of cross-shard entries applied here (most recent XID_MEMORY)
+xid_lock = threading.Lock()
+XID_MEMORY = 100000
+outbox = queue.Queue()  # (shard, transfer) commit decisions still to deliver to a participant shard
+undelivered = {}        # leader: seq -> xid of our coordinator halves the participant has not confirmed
+delivered_through = 0   # every decision we coordinated at or below this seq reached its participant
+decisions_loaded = False  # leader: requeue_decisions has filled `undelivered` for this term
+
+# Durable write-ahead log (enabled with --data-dir); appends happen under log_lock
+wal = None
+WAL_SYNC_INTERVAL = 0.01  # seconds between group fsyncs (--wal-sync-interval)
+
+class PhiAccrualDetector:
+    """
+    Phi accrual failure detector (Hayashibara et al.) for the leader's heartbeats.
+    Keeps a window of heartbeat inter-arrival times and reports
+    phi = -log10(P(a heartbeat arrives later than now)) under a normal fit of that window,
+    so the suspicion threshold adapts to the jitter actually seen instead of a fixed timeout.
+    Arrivals closer together than half the heartbeat interval (bursts of piggybacked
+    replication batches) refresh liveness but are not sampled, which keeps the window at
+    heartbeat scale.
+    """
+
+    def __init__(self, interval, window=100, acceptable_pause=None):
+        self.interval = interval
+        self.min_std = interval / 4
+        self.acceptable_pause = interval if acceptable_pause is None else acceptable_pause
+        self.samples = deque(maxlen=window)
+        self.last = time.time()
+
+    def heartbeat(self):
+        now = time.time()
+        gap = now - self.last
+        if gap >= self.interval / 2:
+            self.samples.append(gap)
+        self.last = now
+
+    def reset(self):
+        """Restart the silence clock (new leader, or an election was just started)."""
+        self.last = time.time()
+
+    def phi(self):
+        n = len(self.samples)
+        mean = sum(self.samples) / n if n else self.interval
+        std = math.sqrt(sum((x - mean) ** 2 for x in self.samples) / n) if n else 0.0
+        std = max(std, self.min_std)
+        y = (time.time() - self.last - mean - self.acceptable_pause) / std
+        # logistic approximation of the normal CDF tail (as used by Akka / Cassandra)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y)) if y > -20 else math.inf
+        p_later = e / (1.0 + e) if y > 0 else 1.0 - 1.0 / (1.0 + e)
+        return -math.log10(max(p_later, 1e-300))
+
+# For heartbeat monitoring (overridable via --heartbeat-interval / --phi-threshold)
+HEARTBEAT_INTERVAL = 0.1  # the leader sends /heartbeat to a follower it sent nothing for this long
+PHI_THRESHOLD = 8.0       # a follower suspects the leader once phi exceeds this
+detector = PhiAccrualDetector(HEARTBEAT_INTERVAL)
+term = 0                  # leader epoch; bumped by each node that wins an election
+leader_commit = 0         # leader's commit index as of its last heartbeat
+
+# Elections (overridable via --election-timeout / --coordinator-timeout)
+ELECTION_TIMEOUT = 0.2     # how long to wait for an /answer from a higher node
+COORDINATOR_TIMEOUT = 1.0  # how long to wait for /coordinator after an answer before retrying
+ELECTION_RETRIES = 3
+peer_ids = {}              # peer URL -> node id, learned once (ids never change)
+election_lock = threading.Lock()     # one election at a time on this node
+answer_event = threading.Event()     # set by /answer: a higher node is alive
+coordinator_event = threading.Event()  # set by /coordinator: a leader was announced
+leader_lost_at = None      # last heartbeat from the leader we lost (None when not failing over)
+leader_lost_detected = None  # when the failure detector fired
+last_failover = None       # timings of the most recent failover, shown in /status
+
+# Follower reads (overridable via --lease-duration / --read-wait). A leader can be replaced
+# while its lease still runs (a higher node preempting it), so a node never moves to a new
+# leader until LEASE_DURATION has passed since it last acked the previous one; keep the
+# lease shorter than the time followers need to suspect the leader and elect another one.
+LEASE_DURATION = 0.2   # a leader serves linearizable reads this long after a majority acked it
+READ_WAIT = 1.0        # how long a read waits for local state to catch up before forwarding
+lease_start = None     # earliest ack time that counts toward our lease; None while not leading
+leader_acked_at = 0.0  # when we last accepted a message from the leader we follow
+
+# Replication pipeline (overridable via --batch-size / --batch-linger / --replication-window /
+# --replication-queue)
+REPLICATION_MAX_BATCH = 64     # max entries per /commit request
+REPLICATION_LINGER = 0.005     # seconds to wait for more entries before sending a batch
+REPLICATION_RETRY = 0.2        # backoff before resending a batch a follower did not take
+REPLICATION_WINDOW = 1024      # entries in flight (sent, not yet acked) per follower
+REPLICATION_QUEUE = 4096       # submissions queued per follower before the backlog is dropped
+
+# Commit acknowledgement (overridable via --acks / --commit-timeout). With "quorum" a client
+# hears "committed" only once its entry is applied on a majority (counting the leader), i.e.
+# once the leader's commit index has passed it; "leader" acks as soon as the leader applied it.
+ACKS = "quorum"
+COMMIT_TIMEOUT = 2.0     # how long a write waits for a majority before answering "uncommitted"
+commit_index = 0         # leader: highest seq applied on a majority
+reconciled_term = None   # term whose takeover (on_become_leader) we completed
+commit_cond = threading.Condition()  # notified whenever commit_index advances
+seq_times = deque(maxlen=100000)     # leader: (last seq, time) per local commit, for lag in seconds
+
+# Snapshots / log compaction (overridable via --snapshot-every / --snapshot-retain)
+SNAPSHOT_EVERY = 10000   # newly applied entries that trigger a snapshot
+SNAPSHOT_RETAIN = 1000   # entries kept behind a snapshot for followers that lag slightly
+
+# Writes sent to a follower (--follower-writes): "proxy" forwards them to the leader over
+# a keep-alive pool; "redirect" answers 307 with the leader's URL so clients go direct
+FOLLOWER_WRITES = "proxy"
+LEADER_POOL = 64  # pooled connections to the leader for proxied writes and reads
+leader_session = requests.Session()
+leader_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=LEADER_POOL))
+
+# Batch submission
+TRANSACTIONS_MAX = 10000  # transfers accepted per /transactions request
+
+# /log streaming
+LOG_STREAM_CHUNK = 1000  # entries per chunk written to the /log response
+
+# Peer wire format (overridable via --wire-codec / --compress-min): log entries travel between
+# nodes as "binary" fixed-layout records (bank_codec.py) or as "json". A peer that rejects
+# binary with 415 (an older node) gets JSON from then on; bodies over COMPRESS_MIN bytes
+# are deflated.
+WIRE_CODEC = "binary"
+COMPRESS_MIN = 64 * 1024
+json_only_peers = set()
+
+# Peer fan-outs (elections, heartbeats, reconciliation) issue every call at once
+async_runtime = None     # bank_async.AsyncRuntime when started with --async
+FANOUT_TIMEOUT = 1.0     # default per-call deadline of a fan-out
+fanout_pool = ThreadPoolExecutor(max_workers=32)  # runs fan-out calls when not in --async mode
+fanout_sessions = threading.local()               # one keep-alive requests.Session per pool thread
 
 # Utility functions
 def increment_lamport(received=None):
-    global lamport
-    with lamport_lock:
-        if received is None:
-            lamport += 1
-        else:
-            lamport = max(lamport, received) + 1
-        return lamport
+    if received is None:
+        return clock.tick()
+    return clock.merge(received)
+
+def shard_of(account):
+    return zlib.crc32(account.encode()) % len(SHARDS)
+
+def owns(account):
+    return SHARD is None or shard_of(account) == SHARD
 
 def apply_transaction_entry(entry):
-    """Apply an entry from log to balances (idempotent if applied once)."""
-    with balances_lock:
-        balances[entry['from']] -= entry['amount']
-        balances[entry['to']] += entry['amount']
+    """Apply an entry from log to balances (idempotent if applied once); only accounts we own move."""
+    balances.move(entry['from'] if owns(entry['from']) else None,
+                  entry['to'] if owns(entry['to']) else None,
+                  entry['amount'], entry['seq'])
+
+def remember_ids(entries):
+    """
+    Index the xids and client txids among `entries`, so neither a redelivered cross-shard
+    decision nor a retried client submit is applied twice.
+    """
+    txids.add(entries)
+    for e in entries:
+        if e.get('xid'):
+            applied_xids[e['xid']] = e['seq']
+            if len(applied_xids) > XID_MEMORY:
+                applied_xids.popitem(last=False)
+
+def forget_ids(entries):
+    """Undo remember_ids for entries dropped from our log, so their txids and xids can commit again."""
+    txids.forget(entries)
+    for e in entries:
+        if e.get('xid') and applied_xids.get(e['xid']) == e['seq']:
+            del applied_xids[e['xid']]
+
+def commit_entry(entry):
+    """Apply an entry that just joined the applied prefix and record it in the WAL (under log_lock)."""
+    apply_transaction_entry(entry)
+    remember_ids((entry,))
+    entries_applied.inc()
+    if wal is not None:
+        wal.append(entry)
+
+def commit_entries(entries):
+    """commit_entry for a run of entries, indexing and logging them to the WAL in one go."""
+    for e in entries:
+        apply_transaction_entry(e)
+    remember_ids(entries)
+    entries_applied.inc(len(entries))
+    if wal is not None:
+        wal.extend(entries)
+
+def checkpoint_wal(balances_now):
+    """After balances were replaced wholesale, persist them as the on-disk base (under log_lock)."""
+    if wal is not None:
+        wal.checkpoint(transaction_log.applied_seq, balances_now, clock.peek(),
+                       transaction_log.term_at(transaction_log.applied_seq) or 0)
 
 def append_log(entry):
+    append_entries((entry,))
+
+def append_entries(entries, prev=None, leader_term=None):
+    """
+    Add replicated entries under one log_lock hold and apply whatever became ready.
+    `prev` is the leader's [seq, term] just before the first entry. Returns False, taking
+    nothing past the conflict, if our log holds a different term at `prev` or at any of the
+    entries' seqs: it diverged from the leader's and must be overwritten (catch-up does that).
+    """
     with log_lock:
-        # prevent duplicates by seq
-        existing = next((e for e in transaction_log if e['seq'] == entry['seq']), None)
-        if existing is None:
-            transaction_log.append(entry)
-            transaction_log.sort(key=lambda e: e['seq'])
-            apply_transaction_entry(entry)
+        if leader_term is not None and leader_term != transaction_log.pending_term:
+            # what an older leader left buffered behind a gap may never have committed
+            transaction_log.drop_pending()
+            transaction_log.pending_term = leader_term
+        if prev is not None:
+            held = transaction_log.term_at(prev[0])
+            if held is not None and held != prev[1]:
+                return False
+        # duplicates and out-of-order entries are handled by the log itself
+        ready = []
+        for e in entries:
+            held = transaction_log.term_at(e['seq'])
+            if held is not None and held != e.get('term', 0):
+                commit_entries(ready)
+                return False
+            ready.extend(transaction_log.add(e))
+        commit_entries(ready)
+    return True
 
-def broadcast_commit(entry):
-    """Leader tells all peers to commit this entry."""
-    for p in PEERS:
+def overwrite_log(snapshot, entries):
+    """
+    Make `snapshot` plus `entries` (a list or a ColumnarLog over our names) our log whatever
+    ours holds, rebuilding balances from it (under log_lock). Our entries past the snapshot
+    that it does not hold (another entry at their seq, whatever the terms), and those buffered
+    past a gap, are dropped along with their txids and xids. Returns how many were dropped.
+    """
+    identity = lambda e: (e['seq'], e.get('lamport', 0), e.get('client_txid'), e.get('xid'))
+    old = list(transaction_log.since(snapshot['seq'])) + transaction_log.drop_pending()
+    transaction_log.install(snapshot, entries)
+    kept = set(map(identity, transaction_log.since(snapshot['seq'])))
+    dropped = [e for e in old if identity(e) not in kept]
+    forget_ids(dropped)
+    store = transaction_log.entries
+    for i in range(0, len(store), LOG_STREAM_CHUNK):
+        remember_ids(list(store.dicts(i, min(i + LOG_STREAM_CHUNK, len(store)))))
+    balances.replace(replay(snapshot), seq=transaction_log.applied_seq)
+    checkpoint_wal(dict(balances.snapshot()))
+    return len(dropped)
+
+def replay(snapshot):
+    """
+    Balances obtained by applying our applied log's entries newer than `snapshot` on top of it.
+    Nets the transfers per account off the log's columns, so owns() runs once per account.
+    """
+    result = defaultdict(int, snapshot['balances'])
+    for account, delta in transaction_log.net_flows_since(snapshot['seq']).items():
+        if owns(account):
+            result[account] += delta
+    return result
+
+def take_snapshot():
+    with log_lock:
+        # applies happen under log_lock, so the balances match applied_seq exactly here
+        transaction_log.compact(dict(balances.snapshot()), SNAPSHOT_RETAIN)
+        seq = transaction_log.snapshot['seq']
+        checkpoint_wal(transaction_log.snapshot['balances'])
+    print(f"[{NODE_ID}] Snapshot at seq {seq}")
+
+def snapshot_monitor():
+    """Take a snapshot (and truncate the log) once enough new entries have been applied."""
+    while True:
+        time.sleep(1.0)
+        if transaction_log.applied_seq - transaction_log.snapshot['seq'] >= SNAPSHOT_EVERY:
+            take_snapshot()
+
+def snapshot_payload(codec, extra=None):
+    """
+    Body for /install_snapshot and /snapshot: our snapshot plus the log retained after it
+    (and the fields in `extra`, e.g. the leader's heartbeat fields).
+    """
+    with log_lock:
+        entries = transaction_log.view()
+        fields = {"snapshot": transaction_log.snapshot, "lamport": clock.peek(), "seq_counter": seq_counter,
+                  **(extra or {})}
+    return encode_message(codec, fields, entries, "log", COMPRESS_MIN)
+
+def peer_codec(peer):
+    return "json" if WIRE_CODEC == "json" or peer in json_only_peers else "binary"
+
+def post_peer(session, peer, path, fields, entries, key="entries", timeout=1.0):
+    """POST a message with log entries in the peer's codec, falling back to JSON if it answers 415."""
+    body = encode_message(peer_codec(peer), fields, entries, key, COMPRESS_MIN)
+    r = session.post(peer + path, data=body, headers=body.headers, timeout=timeout)
+    if r.status_code == 415 and peer not in json_only_peers:
+        print(f"[{NODE_ID}] {peer} does not accept {BINARY_TYPE}; sending it JSON")
+        json_only_peers.add(peer)
+        body = encode_message("json", fields, entries, key, COMPRESS_MIN)
+        r = session.post(peer + path, data=body, headers=body.headers, timeout=timeout)
+    return r
+
+def peer_message():
+    """
+    The body of a peer request carrying log entries, in whichever codec it came. Returns
+    (message, None), or (None, error response) when the body cannot be read.
+    """
+    try:
+        return decode_message(request.get_data(), request.content_type,
+                              request.headers.get("Content-Encoding")), None
+    except UnsupportedCodec as e:
+        return None, (jsonify({"status":"unsupported_media_type","message":str(e)}), 415)
+    except Exception as e:
+        return None, (jsonify({"status":"bad_request","message":str(e)}), 400)
+
+def encode_log_ndjson(header, entries):
+    """Yield a header line followed by one JSON entry per line, LOG_STREAM_CHUNK lines at a time."""
+    yield json.dumps(header) + "\n"
+    chunk = []
+    for e in entries:
+        chunk.append(json.dumps(e))
+        if len(chunk) >= LOG_STREAM_CHUNK:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+def encode_log_frames(header, entries):
+    """Binary counterpart of encode_log_ndjson: a header frame, then LOG_STREAM_CHUNK entries per frame."""
+    yield frame(header, [])
+    chunk = []
+    for e in entries:
+        chunk.append(e)
+        if len(chunk) >= LOG_STREAM_CHUNK:
+            yield frame({}, chunk, COMPRESS_MIN)
+            chunk = []
+    if chunk:
+        yield frame({}, chunk, COMPRESS_MIN)
+
+def blocking_call(method, url, body, timeout):
+    """One fan-out call over this thread's session; (status, text), or None on failure."""
+    session = getattr(fanout_sessions, "session", None)
+    if session is None:
+        session = fanout_sessions.session = requests.Session()
+    kwargs = {"timeout": timeout}
+    if isinstance(body, Encoded):
+        kwargs.update(data=body, headers=body.headers)
+    elif isinstance(body, (str, bytes)):
+        kwargs.update(data=body, headers={"Content-Type": "application/json"})
+    elif body is not None:
+        kwargs["json"] = body
+    try:
+        r = session.request(method, url, **kwargs)
+        return r.status_code, r.text
+    except Exception:
+        return None
+
+def fan_out(method, calls, timeout=None):
+    """
+    Send one request per (url, body) in `calls` concurrently and wait for all of them.
+    body is a dict (sent as JSON), a pre-encoded JSON string, a bank_codec.Encoded body
+    (sent with its own headers), or None. Each call has its
+    own deadline, so the fan-out lasts as long as the slowest peer that answers in time.
+    Returns a list aligned with `calls` of (status, text), or None for a failed call.
+    """
+    timeout = timeout or FANOUT_TIMEOUT
+    if not calls:
+        return []
+    if async_runtime is not None:
+        return async_runtime.fan_out(method, calls, timeout)
+    futures = [fanout_pool.submit(blocking_call, method, url, body, timeout) for url, body in calls]
+    return [f.result() for f in futures]
+
+def json_or_none(res):
+    """Parsed body of a 200 fan-out result, else None."""
+    if res is None or res[0] != 200:
+        return None
+    try:
+        return json.loads(res[1])
+    except ValueError:
+        return None
+
+def open_log_stream(peer, since, term):
+    """
+    Start reading peer's /log?since=&term=. Returns (header, entries, close) where entries
+    lazily yields the seq-sorted entries as they come off the wire and close() drops the
+    stream unread, or None if the peer did not answer. A peer that dies mid-stream just ends
+    its stream early.
+    """
+    session = getattr(fanout_sessions, "session", None)
+    if session is None:
+        session = fanout_sessions.session = requests.Session()
+    accept = "application/x-ndjson" if peer_codec(peer) == "json" else BINARY_TYPE + ", application/x-ndjson"
+    try:
+        r = session.get(peer + "/log", params={"since": since, "term": term}, headers={"Accept": accept}, stream=True, timeout=5.0)
+        if r.status_code != 200:
+            r.close()
+            return None
+        if r.headers.get("Content-Type", "").startswith(BINARY_TYPE):
+            frames = read_frames(r.raw)
+            header = next(frames)
+            header.pop("log")
+            chunks = (message["log"] for message in frames)
+        else:
+            lines = r.iter_lines()
+            header = json.loads(next(lines))
+            chunks = ([json.loads(line)] for line in lines if line)
+    except Exception:
+        return None
+
+    def entries():
         try:
-            requests.post(p + "/commit", json=entry, timeout=1.0)
+            for chunk in chunks:
+                yield from chunk
         except Exception:
             pass
+        finally:
+            r.close()
+    return header, entries(), r.close
 
-def get_state_snapshot():
-    with log_lock, balances_lock, lamport_lock:
-        return {
-            "log": list(transaction_log),
-            "balances": dict(balances),
-            "lamport": lamport,
-            "seq_counter": seq_counter
-        }
+class PeerReplicator:
+    """
+    Long-lived replication worker for one follower.
+    Entries queued by the leader are group-committed as {"entries": [...]} batches over a
+    keep-alive session; a batch the follower did not take is retried while we lead.
+    Queue items are lists of entries; a multi-entry submission is sent whole, never split.
+    Batches are pipelined: up to REPLICATION_WINDOW entries may be in flight at once, each
+    batch on its own pooled connection. Batches that overtake each other wait in the
+    follower's pending buffer, and `match` (the follower's contiguous applied prefix, as it
+    last reported it) feeds the leader's commit index, once the term it reports for that seq
+    shows its log is ours up to there.
+    The queue holds at most REPLICATION_QUEUE submissions: a follower that is down or too slow
+    has its backlog dropped, and catch-up sends it from the log (or our snapshot) instead.
+    """
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.queue = queue.Queue(maxsize=REPLICATION_QUEUE)
+        senders = max(1, REPLICATION_WINDOW // REPLICATION_MAX_BATCH)
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=senders))
+        self.senders = ThreadPoolExecutor(max_workers=senders)
+        self.window = threading.Condition()
+        self.inflight = {}    # id(batch) -> lowest seq of a batch sent but not yet acked
+        self.inflight_entries = 0
+        self.catching_up = threading.Lock()
+        self.match = 0        # highest seq the follower reported as applied (contiguously)
+        self.generation = 0   # bumped when its log is overwritten; replies to older sends no longer count
+        self.dropped_through = 0  # highest seq dropped from the queue; catch-up owes the follower up to here
+        self.last_sent = 0.0  # when the follower last heard from us; heartbeats fill the gaps
+        self.acked = 0.0      # send time of the latest request the follower accepted (lease)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, entries):
+        try:
+            self.queue.put_nowait(entries)
+        except queue.Full:
+            self.drop_backlog(entries)
+
+    def drop_backlog(self, entries):
+        """The queue is full: forget it and `entries`, and catch the follower up from the log."""
+        dropped = [entries]
+        while True:
+            try:
+                dropped.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.dropped_through = max([self.dropped_through] + [batch[-1]['seq'] for batch in dropped])
+        print(f"[{NODE_ID}] Replication queue to {self.peer} full; dropped {sum(map(len, dropped))} "
+              f"entries, catching up from seq {self.match}")
+        if leader_ready():
+            self.senders.submit(self.catch_up, self.match)
+
+    def next_batch(self):
+        """Block for one submission, then linger briefly to fill the batch."""
+        batch = list(self.queue.get())
+        deadline = time.time() + REPLICATION_LINGER
+        while len(batch) < REPLICATION_MAX_BATCH:
+            try:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    batch.extend(self.queue.get(timeout=remaining))
+                else:
+                    batch.extend(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not IS_LEADER:
+                continue
+            # wait for room in the window; a batch larger than the window goes out alone
+            with self.window:
+                while self.inflight and self.inflight_entries + len(batch) > REPLICATION_WINDOW:
+                    self.window.wait()
+                self.inflight[id(batch)] = batch[0]['seq']
+                self.inflight_entries += len(batch)
+            self.senders.submit(self.send, batch)
+
+    def batch_fields(self, batch):
+        """The leader's [seq, term] just before `batch`, for the follower's log matching check."""
+        prev = batch[0]['seq'] - 1
+        return {"prev": [prev, transaction_log.term_at(prev)]}
+
+    def send(self, batch):
+        applied = None
+        rtt = replication_rtt.child(follower=self.peer)
+        try:
+            while IS_LEADER:
+                try:
+                    # every batch doubles as a heartbeat
+                    sent, generation = time.time(), self.generation
+                    r = post_peer(self.session, self.peer, "/commit", {**heartbeat_fields(), **self.batch_fields(batch)}, batch)
+                    self.last_sent = time.time()
+                    if r.status_code == 409:
+                        step_down(r.json())
+                        break
+                    if r.status_code == 200:
+                        rtt(self.last_sent - sent)
+                        self.acked = max(self.acked, sent)
+                        reply = r.json()
+                        applied = reply.get("applied_seq")
+                        break
+                except Exception:
+                    pass
+                time.sleep(REPLICATION_RETRY)
+        finally:
+            with self.window:
+                del self.inflight[id(batch)]
+                self.inflight_entries -= len(batch)
+                # a hole below this batch that no batch still in flight will fill
+                gap = applied is not None and applied < batch[0]['seq'] - 1 and \
+                      not any(low <= applied + 1 for low in self.inflight.values())
+                self.window.notify()
+        if applied is not None:
+            self.record_reply(reply, generation)
+            if gap and reply.get("status") != "diverged":
+                self.catch_up(applied)
+
+    def record_reply(self, reply, generation):
+        """A /commit, /heartbeat or /install_snapshot reply sent while self.generation was `generation`."""
+        self.record_match(reply.get("applied_seq", 0), reply.get("applied_term"),
+                          reply.get("status") == "diverged", generation)
+
+    def record_match(self, applied, applied_term, diverged=False, generation=None):
+        """
+        The follower reported `applied`, its entry there being of `applied_term`; see whether
+        that moves the commit index. It only counts if we hold the same entry: equal terms at
+        one seq mean equal logs up to it.
+        """
+        if not leader_ready() or (generation is not None and generation != self.generation):
+            return  # mid-takeover, or an answer from before its log was overwritten
+        if diverged or transaction_log.term_at(applied) != applied_term:
+            # it holds entries we never wrote (a suffix from an older term), or ours are
+            # compacted past its position: overwrite its log with our snapshot
+            self.senders.submit(self.catch_up, applied, True)
+            return
+        if applied > self.match:
+            self.match = applied
+            advance_commit()
+        if applied < self.dropped_through:
+            # it still misses entries its queue dropped (catch-up may have failed while it was down)
+            self.senders.submit(self.catch_up, applied)
+
+    def catch_up(self, applied, truncate=False):
+        """
+        The follower is missing the seqs after `applied` (it restarted or lost batches).
+        Resend them from the log, or ship our snapshot if compaction already dropped them.
+        With `truncate` (its log does not match ours) it gets our snapshot with its log
+        overwritten. Every request carries our heartbeat fields, so a follower that moved on
+        to a newer term refuses it, and we stop as soon as we no longer lead.
+        """
+        if not self.catching_up.acquire(blocking=False):
+            return  # another sender is already on it
+        try:
+            self.resend(applied, truncate)
+        except Exception:
+            pass
+        finally:
+            self.catching_up.release()
+
+    def resend(self, applied, truncate):
+        if not IS_LEADER:
+            return
+        with log_lock:
+            compacted = transaction_log.first_seq() > applied + 1
+            missing = transaction_log.since(applied)
+        if compacted or truncate:
+            print(f"[{NODE_ID}] Sending snapshot to {self.peer} (applied_seq={applied})")
+            if truncate:
+                # acks of batches sent before this overwrite may cover entries it discards
+                self.generation += 1
+                self.match = 0
+            generation = self.generation
+            body = snapshot_payload(peer_codec(self.peer), {**heartbeat_fields(), "truncate": truncate})
+            r = self.session.post(self.peer + "/install_snapshot", data=body, headers=body.headers, timeout=5.0)
+            if r.status_code == 409:
+                step_down(r.json())
+                return
+            self.record_reply(r.json(), generation)
+            return
+        batch = []
+        for e in missing:
+            if not IS_LEADER:
+                return
+            batch.append(e)
+            if len(batch) >= REPLICATION_MAX_BATCH:
+                if not self.resend_batch(batch):
+                    return self.resend(applied, True)
+                batch = []
+        if batch and IS_LEADER and not self.resend_batch(batch):
+            return self.resend(applied, True)
+
+    def resend_batch(self, batch):
+        """POST one catch-up batch; False if the follower's log turned out not to match ours."""
+        generation = self.generation
+        r = post_peer(self.session, self.peer, "/commit", {**heartbeat_fields(), **self.batch_fields(batch)}, batch)
+        if r.status_code == 409:
+            step_down(r.json())  # we no longer lead: the loop in resend() stops
+            return True
+        reply = r.json()
+        self.record_reply(reply, generation)
+        return reply.get("status") != "diverged"
+
+replicators = []  # one PeerReplicator per peer, started in main
+
+def advance_commit():
+    """Leader: raise commit_index to the highest seq a majority (counting us) has applied."""
+    global commit_index
+    matches = sorted([transaction_log.applied_seq] + [r.match for r in replicators], reverse=True)
+    index = matches[len(matches) // 2]
+    if index > commit_index:
+        with commit_cond:
+            if index > commit_index:
+                commit_index = index
+                commit_cond.notify_all()
+
+def leader_ready():
+    """True while we lead and have finished reconciling for this term; only then do we take writes."""
+    return IS_LEADER and reconciled_term == term
+
+def reconciling_reply():
+    return jsonify({"status":"no_leader","leader":LEADER,"message":"leader is still reconciling"}), 503
+
+def wait_committed(seq):
+    """
+    Leader: block until `seq` is at or below the commit index. False if that takes longer
+    than COMMIT_TIMEOUT or we stop leading meanwhile (the entry may still survive).
+    """
+    if ACKS == "leader":
+        return True
+    deadline = time.time() + COMMIT_TIMEOUT
+    with commit_cond:
+        while commit_index < seq:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not IS_LEADER:
+                return False
+            # wake periodically to notice a lost leadership
+            commit_cond.wait(min(remaining, HEARTBEAT_INTERVAL))
+    return True
+
+def committed_through():
+    """The highest seq known to be on a majority: our commit index, or the leader's as last heard."""
+    return commit_index if IS_LEADER else leader_commit
+
+def decisions_delivered():
+    """Leader: the seq every cross-shard decision at or below has reached its participant."""
+    global delivered_through
+    if decisions_loaded:
+        seqs = list(undelivered)
+        delivered_through = max(delivered_through, min(seqs) - 1 if seqs else commit_index)
+    return delivered_through
+
+def heartbeat_fields():
+    """What a leader tells followers on every /heartbeat and /commit batch."""
+    return {"term": term, "leader": LEADER, "commit": commit_index, "delivered": decisions_delivered()}
+
+def accept_heartbeat(data):
+    """
+    Follower side of a /heartbeat or piggybacked batch. Returns False if it comes from a
+    leader of an older term; otherwise adopts the sender as leader and feeds the detector.
+    """
+    global term, LEADER, IS_LEADER, leader_commit, delivered_through, decisions_loaded, leader_acked_at
+    if data['term'] < term:
+        return False
+    if data['term'] > term or data['leader'] != LEADER:
+        wait_out_lease(data['term'])
+        term, LEADER = data['term'], data['leader']
+        persist_term()
+        IS_LEADER = False
+        decisions_loaded = False
+    leader_commit = max(leader_commit, data['commit'])
+    delivered_through = max(delivered_through, data.get('delivered', 0))
+    detector.heartbeat()
+    leader_acked_at = time.time()
+    return True
+
+def wait_out_lease(new_term):
+    """
+    Before following a new leader: fence in `new_term` (the previous leader's messages are
+    stale from now on, so we ack it no more), then wait until our last ack to it is
+    LEASE_DURATION old, so no lease it holds can still count on us.
+    """
+    global term
+    term = max(term, new_term)
+    persist_term()
+    remaining = leader_acked_at + LEASE_DURATION - time.time()
+    if remaining > 0:
+        time.sleep(remaining)
+
+def step_down(reply):
+    """A follower rejected us as a stale leader; follow the leader it knows."""
+    global term, LEADER, IS_LEADER, lease_start
+    if reply.get('term', 0) > term:
+        print(f"[{NODE_ID}] Stepping down: term {reply['term']} > {term}, leader {reply.get('leader')}")
+        term, LEADER, IS_LEADER = reply['term'], reply.get('leader'), False
+        persist_term()
+        lease_start = None
+        detector.reset()
+
+def applied_position():
+    """What a follower reports back to the leader: its applied_seq and the term of the entry there."""
+    with log_lock:
+        return {"applied_seq": transaction_log.applied_seq, "applied_term": transaction_log.last_term()}
+
+def persist_term():
+    """
+    With --data-dir, make the current term durable before we act in it: a node that forgot
+    the terms it saw could reuse one after a restart, and two leaders' entries would then
+    look alike. Only a rise in term is written.
+    """
+    if wal is not None:
+        wal.save_term(term)
+
+def stale_leader_reply():
+    return jsonify({"status": "stale", "term": term, "leader": LEADER}), 409
+
+def fenced(data):
+    """Whether a peer request carries the leader's heartbeat fields (its term above all)."""
+    return all(k in data for k in ("term", "leader", "commit"))
+
+def missing_term_reply():
+    return jsonify({"status":"bad_request","message":"missing the leader's term"}), 400
+
+def broadcast_commit(entry):
+    """Leader tells all peers to commit this entry (queued on each peer's replicator)."""
+    broadcast_entries([entry])
+
+def broadcast_entries(entries):
+    """Queue a run of entries on every replicator as one unit."""
+    if entries:
+        for r in replicators:
+            r.submit(entries)
 
 # Flask endpoints
 
@@ -88,69 +1077,682 @@ def status():
         "port": PORT,
         "is_leader": IS_LEADER,
         "leader": LEADER,
-        "lamport": lamport,
+        "term": term,
+        "leader_commit": committed_through(),
+        "lamport": clock.peek(),
         "seq_counter": seq_counter,
-        "balances": dict(balances)
+        "shard": SHARD,
+        "last_failover": last_failover,
+        "balances": balances.snapshot()
     })
 
+def replication_lag():
+    """Leader: {follower: (entries behind, seconds its oldest missing entry has waited)}."""
+    if not IS_LEADER:
+        return {}
+    applied, now = transaction_log.applied_seq, time.time()
+    times = list(seq_times)
+    lag = {}
+    for r in replicators:
+        behind = max(0, applied - r.match)
+        seconds = 0.0
+        if behind:
+            i = bisect_right(times, r.match, key=itemgetter(0))
+            seconds = now - times[min(i, len(times) - 1)][1] if times else 0.0
+        lag[r.peer] = (behind, seconds)
+    return lag
+
+Gauge("bank_is_leader", "1 while this node leads", fn=lambda: int(IS_LEADER))
+Gauge("bank_term", "Current leader term", fn=lambda: term)
+Gauge("bank_applied_seq", "Highest seq of the contiguous applied prefix", fn=lambda: transaction_log.applied_seq)
+Gauge("bank_commit_index", "Highest seq known to be applied on a majority", fn=lambda: committed_through())
+Gauge("bank_log_entries", "Entries held in the in-memory log", fn=lambda: len(transaction_log))
+Gauge("bank_log_pending_entries", "Entries buffered behind a gap", fn=lambda: len(transaction_log.pending))
+Gauge("bank_snapshot_seq", "Seq of the latest snapshot", fn=lambda: transaction_log.snapshot['seq'])
+Gauge("bank_replication_lag_entries", "Leader: entries a follower has yet to apply", labels=("follower",),
+      fn=lambda: {(peer, ): behind for peer, (behind, _) in replication_lag().items()})
+Gauge("bank_replication_lag_seconds", "Leader: age of the oldest entry a follower has yet to apply",
+      labels=("follower",), fn=lambda: {(peer, ): secs for peer, (_, secs) in replication_lag().items()})
+Gauge("bank_replication_inflight_entries", "Leader: entries sent to a follower and not yet acked",
+      labels=("follower",), fn=lambda: {(r.peer, ): r.inflight_entries for r in replicators} if IS_LEADER else {})
+Gauge("bank_last_failover_seconds", "Duration of the most recent failover this node saw, by phase",
+      labels=("phase",), fn=lambda: {(phase, ): last_failover[phase + "_ms"] / 1000
+                                     for phase in ("detect", "elect", "total")} if last_failover else {})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """
+    Sample every thread's stack for ?seconds= (default 10, at most PROFILE_MAX_SECONDS) every
+    ?interval= seconds (default 0.005) and return folded stacks for flamegraph.pl / speedscope.
+    ?idle=0 leaves out threads blocked on locks, queues and sockets. Only with --profiling.
+    """
+    if not PROFILING:
+        return jsonify({"status":"disabled","message":"node started without --profiling"}), 404
+    seconds = min(request.args.get("seconds", 10.0, type=float), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get("interval", 0.005, type=float), 0.001)
+    folded = profiler.capture(seconds, interval, idle=request.args.get("idle", "1") != "0")
+    if folded is None:
+        return jsonify({"status":"busy","message":"a capture is already running"}), 409
+    return Response(folded, mimetype="text/plain")
+
+def commit_local(fields, stamp):
+    """
+    Leader only: stamp `fields` with the next seq and lamport `stamp`, apply and replicate it.
+    Returns (entry, fresh). A client_txid that already committed gets its original entry
+    back with fresh=False and consumes no seq (cross-shard halves dedupe by xid instead).
+    """
+    global seq_counter
+    txid = None if fields.get('xid') else fields.get('client_txid')
+    # seq is assigned inside log_lock, so entries join the log in order and a committer
+    # waits on exactly one lock
+    with log_lock:
+        if txid is not None:
+            prior = txids.get(txid)
+            if prior is not None:
+                return prior, False
+        entry = {"seq": seq_counter, "term": term, "lamport": stamp, **fields}
+        seq_counter += 1
+        if fields.get('xid') and not owns(fields['to']):
+            # our coordinator half: a decision to deliver, tracked from the moment it has a seq
+            undelivered[entry['seq']] = fields['xid']
+        for e in transaction_log.add(entry):  # apply locally
+            commit_entry(e)
+        seq_times.append((entry['seq'], time.time()))
+    # hand off to the per-peer replication workers
+    broadcast_commit(entry)
+    advance_commit()
+    return entry, True
+
+def commit_local_batch(batch, stamp):
+    """
+    commit_local for many transfers at once: one log_lock hold, a contiguous seq range, one
+    apply pass and one replication unit. Returns [(entry, fresh)] in input order; repeats of a
+    committed client_txid, including within the batch itself, get the original entry back.
+    """
+    global seq_counter
+    out = []
+    fresh = []
+    with log_lock:
+        seen = {}   # txids committed earlier in this batch (not in the cache until applied)
+        ready = []
+        for fields in batch:
+            txid = fields.get('client_txid')
+            prior = (seen.get(txid) or txids.get(txid)) if txid is not None else None
+            if prior is not None:
+                out.append((prior, False))
+                continue
+            entry = {"seq": seq_counter, "term": term, "lamport": stamp, **fields}
+            seq_counter += 1
+            ready.extend(transaction_log.add(entry))
+            if txid is not None:
+                seen[txid] = entry
+            out.append((entry, True))
+            fresh.append(entry)
+        commit_entries(ready)
+        if fresh:
+            seq_times.append((fresh[-1]['seq'], time.time()))
+    broadcast_entries(fresh)
+    advance_commit()
+    return out
+
+def duplicate_reply(entry):
+    """Answer a retried client_txid with the result of its original commit."""
+    return jsonify({"status":"committed","entry":entry,"duplicate":True}), 200
+
+def uncommitted_reply(entry):
+    """The entry is in the leader's log but no majority acked it in time; retrying with the same client_txid is safe."""
+    return jsonify({"status":"uncommitted","entry":entry,
+                    "message":"not yet acknowledged by a majority"}), 503
+
 @app.route("/transaction", methods=["POST"])
 def transaction():
     """
     Client posts: {from, to, amount, client_txid}
-    If leader: assign seq, lamport, commit and broadcast.
+    If leader: assign seq, lamport, replicate, and answer once a majority has it.
     If follower: forward to leader (if known) or start election.
     """
-    global seq_counter
     data = request.get_json()
-    increment_lamport()
+    problem = transfer_problem(data)
+    if problem:
+        return jsonify({"status":"bad_request","message":problem}), 400
+    if data.get('client_txid') is not None:
+        # a retry of something already committed (on any node of this shard) is answered here
+        prior = txids.get(data['client_txid'])
+        if prior is not None and prior['seq'] <= committed_through():
+            return duplicate_reply(prior)
+    stamp = increment_lamport()
+    if not owns(data['from']):
+        # the debited account lives in another shard; its leader coordinates the transfer
+        jd = call_shard(shard_of(data['from']), "/transaction", data, timeout=3.0)
+        if jd is None:
+            return jsonify({"status":"shard_unreachable","shard":shard_of(data['from'])}), 503
+        return jsonify(jd), 200 if jd.get("status") == "committed" else 503
     if IS_LEADER:
-        with seq_lock:
-            seq = seq_counter
-            seq_counter += 1
-        entry = {
-            "seq": seq,
-            "lamport": lamport,
+        if not leader_ready():
+            return reconciling_reply()
+        arrived = time.time()
+        fields = {
             "from": data['from'],
             "to": data['to'],
             "amount": data['amount'],
             "client_txid": data.get('client_txid')
         }
-        append_log(entry)  # apply locally
-        # broadcast to followers
-        threading.Thread(target=broadcast_commit, args=(entry,)).start()
+        if not owns(data['to']):
+            return cross_shard_transfer(fields, stamp)
+        entry, fresh = commit_local(fields, stamp)
+        committed = wait_committed(entry['seq'])
+        commit_latency.observe(time.time() - arrived, endpoint="/transaction")
+        if not committed:
+            return uncommitted_reply(entry)
+        if not fresh:
+            return duplicate_reply(entry)
         return jsonify({"status":"committed","entry":entry}), 200
     else:
-        if LEADER:
+        return forward_to_leader("/transaction", data)
+
+def proxied(r):
+    """Flask response for a reply obtained from the leader; X-Leader tells the client where to go next time."""
+    return (r.content, r.status_code, {"Content-Type": r.headers.get("Content-Type", "application/json"),
+                                       "X-Leader": LEADER})
+
+def redirect_to_leader():
+    """307 to the same request on the leader; the body carries the hint for non-HTTP-aware clients."""
+    resp = jsonify({"status":"not_leader","leader":LEADER})
+    resp.status_code = 307
+    resp.headers["Location"] = LEADER + request.full_path.rstrip("?")
+    return resp
+
+def forward_to_leader(path, data, timeout=2.0):
+    """Follower: hand a write to the leader, or start an election if there is none to reach."""
+    if LEADER:
+        if FOLLOWER_WRITES == "redirect":
+            return redirect_to_leader()
+        try:
+            # forward to leader
+            return proxied(leader_session.post(LEADER + path, json=data, timeout=timeout))
+        except Exception:
+            # can't reach leader: trigger election
+            threading.Thread(target=start_election).start()
+            return jsonify({"status":"leader_unreachable","message":"starting election"}), 503
+    else:
+        # no known leader: start election
+        threading.Thread(target=start_election).start()
+        return jsonify({"status":"no_leader","message":"starting election"}), 503
+
+def transfer_problem(t):
+    """Why `t` is not a well-formed transfer, or None if it is."""
+    if not isinstance(t, dict):
+        return "transfer must be an object"
+    for k in ("from", "to"):
+        if not isinstance(t.get(k), str) or not t[k]:
+            return f"'{k}' must be a non-empty string"
+    if isinstance(t.get("amount"), bool) or not isinstance(t.get("amount"), (int, float)):
+        return "'amount' must be a number"
+    # txids are stored and compared as strings; 42 and "42" must not be two different retries
+    if t.get("client_txid") is not None and not isinstance(t["client_txid"], str):
+        return "'client_txid' must be a string"
+    return None
+
+@app.route("/transactions", methods=["POST"])
+def transactions():
+    """
+    Batch submit: {"transfers": [{from, to, amount, client_txid}, ...]} or the bare list.
+    The leader commits all local transfers in one pass (see commit_local_batch); cross-shard
+    ones go through 2PC one by one. "results" holds each transfer's outcome, in order.
+    """
+    data = request.get_json()
+    transfers = data.get("transfers") if isinstance(data, dict) else data
+    if not isinstance(transfers, list):
+        return jsonify({"status":"bad_request","message":"expected a list of transfers"}), 400
+    if len(transfers) > TRANSACTIONS_MAX:
+        return jsonify({"status":"too_large","max":TRANSACTIONS_MAX}), 413
+    if not IS_LEADER:
+        return forward_to_leader("/transactions", data, timeout=30.0)
+    if not leader_ready():
+        return reconciling_reply()
+    arrived = time.time()
+    stamp = increment_lamport()
+    results = [None] * len(transfers)
+    local, remote = [], []
+    for i, t in enumerate(transfers):
+        problem = transfer_problem(t)
+        if problem:
+            results[i] = {"status":"invalid","message":problem}
+            continue
+        fields = {"from": t['from'], "to": t['to'], "amount": t['amount'], "client_txid": t.get('client_txid')}
+        if not owns(fields['from']):
+            # the debited account lives in another shard: submit it there
+            results[i] = {"status":"wrong_shard","shard":shard_of(fields['from'])}
+        elif not owns(fields['to']):
+            remote.append((i, fields))
+        else:
+            local.append((i, fields))
+    for (i, _), (entry, fresh) in zip(local, commit_local_batch([f for _, f in local], stamp)):
+        results[i] = {"status":"committed","seq":entry['seq']} if fresh else \
+                     {"status":"committed","seq":entry['seq'],"duplicate":True}
+    for i, fields in remote:
+        prior = txids.get(fields['client_txid']) if fields['client_txid'] is not None else None
+        if prior is not None:
+            results[i] = {"status":"committed","seq":prior['seq'],"duplicate":True}
+            continue
+        jd = cross_shard_transfer(fields, stamp)[0].get_json()
+        results[i] = {"status":"committed","seq":jd['entry']['seq']} if jd['status'] == "committed" else jd
+    # one wait covers the whole batch: the commit index only moves forward
+    top = max((r['seq'] for r in results if r['status'] == "committed"), default=0)
+    if not wait_committed(top):
+        for r in results:
+            if r['status'] == "committed" and r['seq'] > commit_index:
+                r['status'] = "uncommitted"
+    commit_latency.observe(time.time() - arrived, endpoint="/transactions")
+    committed = [r for r in results if r['status'] == "committed"]
+    duplicates = sum(1 for r in committed if r.get("duplicate"))
+    return jsonify({"committed": len(committed) - duplicates, "duplicates": duplicates,
+                    "failed": len(results) - len(committed), "results": results}), 200
+
+# Reads: any replica answers /balance and /balances from its own state.
+#   ?consistency=stale (default): local state, optionally bounded by ?max_lag= seqs behind
+#     the leader's last advertised commit index and/or ?min_seq= (read-your-writes)
+#   ?consistency=linearizable: the leader confirms it still holds its lease and hands out
+#     its commit index; the replica answers once it has applied up to that index
+# A replica that cannot catch up within READ_WAIT forwards the read to the leader.
+
+def lease_valid():
+    """Leader only: True while a majority (counting us) acked us within LEASE_DURATION."""
+    if not IS_LEADER or lease_start is None:
+        return False
+    needed = (len(replicators) + 1) // 2  # followers needed for a majority
+    if needed == 0:
+        return True
+    acks = sorted((r.acked for r in replicators if r.acked >= lease_start), reverse=True)
+    return len(acks) >= needed and time.time() - acks[needed - 1] < LEASE_DURATION
+
+def confirm_leadership():
+    """Lease lapsed (idle cluster): heartbeat every follower now and re-check."""
+    if not IS_LEADER or lease_start is None:
+        return False
+    # just took over: acks only count once the previous leader's lease has run out
+    remaining = lease_start - time.time()
+    if remaining > 0:
+        time.sleep(remaining)
+    heartbeat_peers(replicators)
+    return lease_valid()
+
+def read_index_now():
+    """
+    Leader: the seq a linearizable read must reflect. That is everything we applied, so the
+    read also waits until a majority holds it and shows no write that could still be lost;
+    None if that takes longer than COMMIT_TIMEOUT.
+    """
+    index = transaction_log.applied_seq
+    return index if wait_committed(index) else None
+
+def wait_applied(seq):
+    """Wait up to READ_WAIT for our balances to reflect `seq`; False if they don't."""
+    deadline = time.time() + READ_WAIT
+    while balances.seq < seq:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.002)
+    return True
+
+def forward_read():
+    """Hand a read we cannot serve to the leader."""
+    if IS_LEADER or not LEADER:
+        return jsonify({"status":"unavailable","leader":LEADER}), 503
+    if FOLLOWER_WRITES == "redirect":
+        return redirect_to_leader()
+    try:
+        return proxied(leader_session.get(LEADER + request.full_path, timeout=READ_WAIT + 1.0))
+    except Exception:
+        return jsonify({"status":"leader_unreachable","leader":LEADER}), 503
+
+def read_balances(accounts):
+    foreign = [a for a in accounts if not owns(a)]
+    if foreign:
+        return jsonify({"status":"wrong_shard","accounts":foreign,"shards":[shard_of(a) for a in foreign]}), 400
+    consistency = request.args.get("consistency", "stale")
+    min_seq = request.args.get("min_seq", 0, type=int)
+    if consistency == "linearizable":
+        if IS_LEADER:
+            if not (lease_valid() or confirm_leadership()):
+                return jsonify({"status":"no_lease","leader":LEADER}), 503
+            index = read_index_now()
+            if index is None:
+                return jsonify({"status":"uncommitted","leader":LEADER,
+                                "message":"latest writes not yet acknowledged by a majority"}), 503
+            min_seq = max(min_seq, index)
+        else:
             try:
-                # forward to leader
-                r = requests.post(LEADER + "/transaction", json=data, timeout=2.0)
-                return (r.text, r.status_code, r.headers.items())
+                index = leader_session.get(LEADER + "/read_index", timeout=READ_WAIT).json()["read_index"]
             except Exception:
-                # can't reach leader: trigger election
-                threading.Thread(target=start_election).start()
-                return jsonify({"status":"leader_unreachable","message":"starting election"}), 503
+                return forward_read()
+            min_seq = max(min_seq, index)
+    elif consistency == "stale":
+        max_lag = request.args.get("max_lag", type=int)
+        if max_lag is not None and not IS_LEADER:
+            min_seq = max(min_seq, leader_commit - max_lag)
+    else:
+        return jsonify({"status":"bad_request","message":"consistency must be stale or linearizable"}), 400
+    if not wait_applied(min_seq):
+        return forward_read()
+    seq = balances.seq
+    return jsonify({"balances": balances.read(accounts), "seq": seq, "node": NODE_ID,
+                    "consistency": consistency}), 200
+
+@app.route("/balance/<account>", methods=["GET"])
+def get_balance(account):
+    return read_balances([account])
+
+@app.route("/balances", methods=["GET"])
+def get_balances():
+    """?accounts=A,B,C"""
+    accounts = [a for a in request.args.get("accounts", "").split(",") if a]
+    return read_balances(accounts)
+
+@app.route("/read_index", methods=["GET"])
+def read_index():
+    """Leader: the commit index a linearizable read must reflect, while we hold the lease."""
+    if not (lease_valid() or confirm_leadership()):
+        return jsonify({"status":"no_lease","leader":LEADER}), 503
+    index = read_index_now()
+    if index is None:
+        return jsonify({"status":"uncommitted","leader":LEADER}), 503
+    return jsonify({"read_index": index, "term": term}), 200
+
+# Cross-shard transfers: two-phase commit coordinated by the leader of the debited shard.
+# Both shards log the same transfer (tagged with an xid) under their own seq; each applies
+# only the side it owns. The participant votes in /shard/prepare and logs its half on
+# /shard/commit, which is idempotent by xid so the coordinator can redeliver it.
+
+def call_shard(shard, path, payload, timeout=1.0):
+    """POST to the leader of `shard` (cached leader first, then its nodes); returns JSON or None."""
+    candidates = [shard_leaders[shard]] if shard in shard_leaders else []
+    candidates += SHARDS[shard]
+    for url in candidates[:len(SHARDS[shard]) + 2]:
+        try:
+            jd = shard_session.post(url + path, json=payload, timeout=timeout).json()
+        except Exception:
+            continue
+        if jd.get("status") in ("not_leader", "no_leader", "leader_unreachable"):
+            if jd.get("leader"):
+                candidates.insert(candidates.index(url) + 1, jd["leader"])
+            continue
+        shard_leaders[shard] = url
+        return jd
+    shard_leaders.pop(shard, None)
+    return None
+
+def claim_txid(txid):
+    """
+    Claim `txid` for a cross-shard attempt. Returns None once the caller holds the claim
+    (release_txid() when done), or the entry already logged for it. Waits out an attempt
+    still in flight, which either logs an entry or frees the txid for another try.
+    """
+    while True:
+        with transfers_lock:
+            prior = txids.get(txid)
+            if prior is not None:
+                return prior
+            running = transfers_inflight.get(txid)
+            if running is None:
+                transfers_inflight[txid] = threading.Event()
+                return None
+        running.wait()
+
+def release_txid(txid):
+    with transfers_lock:
+        transfers_inflight.pop(txid).set()
+
+def cross_shard_transfer(fields, stamp):
+    """
+    Coordinator side of 2PC for a transfer whose `to` account lives in another shard.
+    Cross-shard halves dedupe by xid rather than client_txid (commit_local), so the txid is
+    claimed here: a retry gets the original attempt's entry, committed or not yet, instead
+    of starting a second 2PC under a new xid.
+    """
+    txid = fields.get('client_txid')
+    if txid is None:
+        return two_phase_commit(fields, stamp)
+    prior = claim_txid(txid)
+    if prior is not None:
+        return duplicate_reply(prior) if prior['seq'] <= commit_index else uncommitted_reply(prior)
+    try:
+        return two_phase_commit(fields, stamp)
+    finally:
+        release_txid(txid)
+
+def two_phase_commit(fields, stamp):
+    xid = f"{SHARD}-{NODE_ID}-{uuid.uuid4().hex}"
+    dst = shard_of(fields['to'])
+    transfer = {**fields, "xid": xid}
+    vote = call_shard(dst, "/shard/prepare", transfer)
+    if vote is None or vote.get("vote") != "yes":
+        call_shard(dst, "/shard/abort", {"xid": xid})
+        return jsonify({"status":"aborted","xid":xid,"message":f"shard {dst} did not prepare"}), 503
+    # the decision is durable once our half is committed in our shard; then tell the participant
+    entry, _ = commit_local(transfer, stamp)
+    transfer["seq"] = entry['seq']
+    if not wait_committed(entry['seq']):
+        # decision_sender delivers it if and when it commits
+        outbox.put((dst, transfer))
+        return uncommitted_reply(entry)
+    if not deliver_decision(dst, transfer):
+        outbox.put((dst, transfer))
+    return jsonify({"status":"committed","entry":entry}), 200
+
+def deliver_decision(shard, transfer):
+    """
+    Send a commit decision to the participant; True once it confirms. A participant leader
+    that never saw our prepare (it took over since) is asked to prepare again first.
+    """
+    reply = call_shard(shard, "/shard/commit", transfer)
+    if reply is not None and reply.get("status") == "not_prepared":
+        vote = call_shard(shard, "/shard/prepare", transfer)
+        if vote is not None and vote.get("vote") == "yes":
+            reply = call_shard(shard, "/shard/commit", transfer)
+    if reply is None or reply.get("status") != "committed":
+        return False
+    undelivered.pop(transfer['seq'], None)
+    return True
+
+def decision_sender():
+    """Redeliver commit decisions that did not reach their participant shard."""
+    while True:
+        shard, transfer = outbox.get()
+        if not IS_LEADER:
+            continue
+        # only a decision a majority of our shard holds may reach the participant
+        if transfer.get('seq', 0) > commit_index or not deliver_decision(shard, transfer):
+            time.sleep(REPLICATION_RETRY)
+            outbox.put((shard, transfer))
+
+def requeue_decisions():
+    """
+    New leader of a coordinating shard: redeliver the cross-shard halves in our log that the
+    previous leader had not seen confirmed (everything after the delivered_through it last
+    advertised; anything older reached its participant already).
+    """
+    global decisions_loaded
+    with log_lock:
+        entries = transaction_log.since(delivered_through)
+    undelivered.clear()
+    for e in entries:
+        if e.get('xid') and owns(e['from']) and not owns(e['to']):
+            undelivered[e['seq']] = e['xid']
+            outbox.put((shard_of(e['to']), {k: e.get(k) for k in ("seq", "from", "to", "amount", "client_txid", "xid")}))
+    decisions_loaded = True
+    print(f"[{NODE_ID}] Redelivering {len(undelivered)} cross-shard decisions after seq {delivered_through}")
+
+@app.route("/shard/prepare", methods=["POST"])
+def shard_prepare():
+    """
+    2PC phase 1: vote yes if we lead the shard that owns the credited account and the
+    transfer is well-formed; remembered until the decision arrives or PREPARE_TTL passes.
+    """
+    data = request.get_json()
+    if not IS_LEADER:
+        return jsonify({"status":"not_leader","leader":LEADER}), 200
+    if not leader_ready():
+        return reconciling_reply()
+    problem = transfer_problem(data)
+    if problem is None and not isinstance(data.get('xid'), str):
+        problem = "'xid' must be a string"
+    if problem is None and not owns(data['to']):
+        problem = f"account {data['to']} is not in shard {SHARD}"
+    if problem:
+        return jsonify({"status":"ok","vote":"no","message":problem}), 200
+    now = time.time()
+    with prepared_lock:
+        # a coordinator that never decided (it died, or gave up) must not pin its transfer forever
+        while prepared and now - next(iter(prepared.values()))[1] > PREPARE_TTL:
+            prepared.popitem(last=False)
+        prepared[data['xid']] = (data, now)
+    return jsonify({"status":"ok","vote":"yes"}), 200
+
+@app.route("/shard/commit", methods=["POST"])
+def shard_commit():
+    """2PC phase 2: log our half of a transfer we prepared, once per xid."""
+    data = request.get_json()
+    if not IS_LEADER:
+        return jsonify({"status":"not_leader","leader":LEADER}), 200
+    if not leader_ready():
+        return reconciling_reply()
+    stamp = increment_lamport()
+    with xid_lock:
+        seq = applied_xids.get(data['xid'])
+        if seq is None:
+            with prepared_lock:
+                vote = prepared.pop(data['xid'], None)
+            if vote is None:
+                # never prepared here (or expired): the coordinator prepares again and retries
+                return jsonify({"status":"not_prepared","xid":data['xid']}), 409
+            transfer = vote[0]
+            seq = commit_local({k: transfer.get(k) for k in ("from", "to", "amount", "client_txid", "xid")}, stamp)[0]['seq']
         else:
-            # no known leader: start election
-            threading.Thread(target=start_election).start()
-            return jsonify({"status":"no_leader","message":"starting election"}), 503
+            with prepared_lock:
+                prepared.pop(data['xid'], None)
+    if not wait_committed(seq):
+        return jsonify({"status":"uncommitted","xid":data['xid'],"seq":seq}), 503
+    return jsonify({"status":"committed","xid":data['xid'],"seq":seq}), 200
+
+@app.route("/shard/abort", methods=["POST"])
+def shard_abort():
+    data = request.get_json()
+    with prepared_lock:
+        prepared.pop(data['xid'], None)
+    return jsonify({"status":"ok"}), 200
 
 @app.route("/commit", methods=["POST"])
 def commit():
-    """Follower receives commit from leader."""
-    entry = request.get_json()
+    """
+    Follower receives commit from leader: a batch {"entries": [...], "prev": [seq, term]}
+    plus the leader's heartbeat fields, in either codec. Bodies without them are
+    refused, since only the term tells a current leader from a deposed one.
+    """
+    data, error = peer_message()
+    if error:
+        return error
+    # every batch carries the leader's heartbeat fields; without a term it cannot be fenced
+    if not fenced(data):
+        return missing_term_reply()
+    if not accept_heartbeat(data):
+        return stale_leader_reply()
+    entries = data["entries"] if "entries" in data else [data]
     # update lamport with leader's lamport stamp
-    increment_lamport(received=entry.get("lamport"))
-    append_log(entry)
-    # record heartbeat from leader (commit implies liveness)
-    global last_leader_heartbeat
-    last_leader_heartbeat = time.time()
-    return jsonify({"status":"ok"}), 200
+    if entries:
+        increment_lamport(received=max(e.get("lamport", 0) for e in entries))
+    matched = append_entries(entries, data.get("prev"), data.get("term"))
+    return jsonify({"status": "ok" if matched else "diverged", **applied_position()}), 200
+
+@app.route("/heartbeat", methods=["POST"])
+def heartbeat():
+    """Leader liveness beacon: {"term", "leader", "commit"}. Touches no log or balance state."""
+    if not accept_heartbeat(request.get_json()):
+        return stale_leader_reply()
+    return jsonify({"term": term, **applied_position()}), 200
 
 @app.route("/log", methods=["GET"])
 def get_log():
-    """Return local log and lamport; used by new leader to collect logs."""
-    with log_lock, lamport_lock:
-        return jsonify({"log": list(transaction_log), "lamport": lamport, "seq_counter": seq_counter}), 200
+    """
+    Stream local log entries with seq > ?since= (default 0) as newline-delimited JSON; used by
+    a new leader to collect the log it takes over. The first line is a header with term,
+    lamport, seq_counter, snapshot_seq, first_seq (lowest seq still in the log), applied_seq,
+    last_term (of the entry at applied_seq) and since_term (of the entry at since, null if
+    we no longer hold it). A ?term= higher than ours is the candidate's: we join it first, so
+    no older leader gets entries onto our log once we have shown it.
+    A client that accepts the binary codec gets binary frames instead, the header first.
+    """
+    global term, IS_LEADER, lease_start
+    since = request.args.get("since", default=0, type=int)
+    fence = request.args.get("term", type=int)
+    with log_lock:
+        if fence is not None and fence > term:
+            if IS_LEADER:
+                print(f"[{NODE_ID}] Stepping down: a leader of term {fence} is taking over")
+                IS_LEADER, lease_start = False, None
+            term = fence
+            persist_term()
+        # the log's entry list is append-only and swapped (not mutated) on compaction, so the
+        # stream is read outside the lock
+        entries = transaction_log.since(since)
+        header = {
+            "term": term,
+            "lamport": clock.peek(),
+            "seq_counter": seq_counter,
+            "snapshot_seq": transaction_log.snapshot['seq'],
+            "first_seq": transaction_log.first_seq(),
+            "applied_seq": transaction_log.applied_seq,
+            "last_term": transaction_log.last_term(),
+            "since_term": transaction_log.term_at(since)
+        }
+    if BINARY_TYPE in request.headers.get("Accept", ""):
+        return Response(encode_log_frames(header, entries), mimetype=BINARY_TYPE)
+    return Response(encode_log_ndjson(header, entries), mimetype="application/x-ndjson")
+
+@app.route("/snapshot", methods=["GET"])
+def get_snapshot():
+    """Our latest snapshot plus the log retained after it (same body as /install_snapshot)."""
+    body = snapshot_payload("binary" if BINARY_TYPE in request.headers.get("Accept", "") else "json")
+    return Response(bytes(body), headers=body.headers)
+
+@app.route("/install_snapshot", methods=["POST"])
+def install_snapshot():
+    """
+    Leader ships {snapshot, log, lamport, seq_counter} plus its heartbeat fields to a lagging
+    follower. We adopt it unless we have already applied past it; with "truncate" (a new
+    leader's takeover, or our log holds seqs the leader never wrote) our log is overwritten
+    whatever it holds.
+    """
+    global seq_counter
+    data, error = peer_message()
+    if error:
+        return error
+    if not fenced(data):
+        return missing_term_reply()
+    if not accept_heartbeat(data):
+        return stale_leader_reply()
+    snapshot = data["snapshot"]
+    entries = data.get("log", [])
+    head = max(snapshot["seq"], entries[-1]["seq"] if entries else 0)
+    increment_lamport(received=data.get("lamport", 0))
+    with log_lock:
+        if data.get("truncate"):
+            dropped = overwrite_log(snapshot, entries)
+            if dropped:
+                print(f"[{NODE_ID}] Dropped {dropped} entries the leader's log does not hold")
+        elif head >= transaction_log.applied_seq:
+            ready = transaction_log.install(snapshot, entries)
+            remember_ids(entries + ready)
+            balances.replace(replay(snapshot), seq=transaction_log.applied_seq)
+            checkpoint_wal(dict(balances.snapshot()))
+    seq_counter = max(seq_counter, data.get("seq_counter", 0))
+    position = applied_position()
+    print(f"[{NODE_ID}] Installed snapshot at seq {snapshot['seq']}, applied_seq={position['applied_seq']}")
+    return jsonify({"status": "ok", **position}), 200
 
 @app.route("/election", methods=["POST"])
 def election_msg():
@@ -160,31 +1762,48 @@ def election_msg():
     """
     data = request.get_json()
     caller_id = data['id']
+    peer_ids[data['reply_to']] = caller_id
     if NODE_ID > caller_id:
         # reply to caller that this node is alive/higher -> caller should not become leader
         try:
-            requests.post(data['reply_to'] + "/answer", json={"id": NODE_ID}, timeout=1.0)
+            requests.post(data['reply_to'] + "/answer", json={"id": NODE_ID, "url": f"http://127.0.0.1:{PORT}"},
+                          timeout=ELECTION_TIMEOUT)
         except:
             pass
-        # then start own election
-        threading.Thread(target=start_election).start()
-        return jsonify({"response":"ok","action":"sent_answer"}), 200
+        if IS_LEADER:
+            # already leading: just tell the caller, no need for a new round (and term)
+            threading.Thread(target=fan_out, args=("POST", [(data['reply_to'] + "/coordinator",
+                             {"leader_url": LEADER, "id": NODE_ID, "term": term})])).start()
+        else:
+            # then start own election
+            threading.Thread(target=start_election).start()
+        return jsonify({"response":"ok","action":"sent_answer","term":term}), 200
     else:
-        return jsonify({"response":"ok","action":"no_answer"}), 200
+        return jsonify({"response":"ok","action":"no_answer","term":term}), 200
 
 @app.route("/answer", methods=["POST"])
 def answer_msg():
-    # Received response from higher node that it's alive.
-    # We simply record this and wait for coordinator message.
-    # The starter election thread has logic to wait for answers.
+    # Received response from higher node that it's alive: wake the election thread,
+    # which then waits for the coordinator message instead of taking over.
+    data = request.get_json(silent=True) or {}
+    if "url" in data:
+        peer_ids[data['url']] = data['id']
+    answer_event.set()
     return jsonify({"received":"ok"}), 200
 
 @app.route("/coordinator", methods=["POST"])
 def coordinator():
     """A node announces itself as leader (coordinator)."""
-    global LEADER, IS_LEADER, seq_counter
+    global LEADER, IS_LEADER, seq_counter, term, lease_start
     data = request.get_json()
+    if data['leader_url'] != LEADER:
+        wait_out_lease(data.get('term', term))
     LEADER = data['leader_url']
+    if "id" in data:
+        peer_ids[LEADER] = data['id']
+    term = data.get('term', term)
+    persist_term()
+    detector.reset()
     # mark leader state
     old_leader = LEADER
     if LEADER.endswith(str(PORT)):
@@ -194,40 +1813,38 @@ def coordinator():
         threading.Thread(target=on_become_leader).start()
     else:
         IS_LEADER = False
+        lease_start = None
+    coordinator_event.set()
+    record_failover()
     return jsonify({"ack":"ok"}), 200
 
-@app.route("/sync_state", methods=["POST"])
-def sync_state():
-    global lamport, balances, transaction_log, seq_counter
-
-    data = request.json
-
-    # Sync Lamport
-    with lamport_lock:
-        lamport = max(lamport, data.get("lamport", 0)) + 1
-
-    # Sync balances
-    incoming_bal = data.get("balances", {})
-    with balances_lock:
-        for k, v in incoming_bal.items():
-            balances[k] = v
-
-    # Sync log
-    incoming_log = data.get("log", [])
-    with log_lock:
-        for entry in incoming_log:
-            if entry not in transaction_log:
-                transaction_log.append(entry)
-
-    # Sync sequence counter
-    seq_counter = max(seq_counter, data.get("seq_counter", 0))
-
-    print(f"[{NODE_ID}] State sync done")
-    return jsonify({"status": "ok"})
-
+# Election functions
 
+def learn_peer_ids(timeout=None):
+    """Ask peers whose id we don't know yet for it; answers are cached in peer_ids."""
+    global term
+    unknown = [p for p in PEERS if p not in peer_ids]
+    results = fan_out("GET", [(p + "/status", None) for p in unknown], timeout=timeout)
+    for p, jd in zip(unknown, map(json_or_none, results)):
+        if jd:
+            peer_ids[p] = jd['id']
+            term = max(term, jd.get('term', 0))
+    persist_term()
 
-# Election functions
+def record_failover():
+    """A new leader is in place: report how long the failover took, if one was under way."""
+    global leader_lost_at, leader_lost_detected, last_failover
+    lost, detected = leader_lost_at, leader_lost_detected
+    if detected is None:
+        return
+    leader_lost_at = leader_lost_detected = None
+    now = time.time()
+    last_failover = {"leader": LEADER,
+                     "detect_ms": round((detected - lost) * 1000, 1),
+                     "elect_ms": round((now - detected) * 1000, 1),
+                     "total_ms": round((now - lost) * 1000, 1)}
+    print(f"[{NODE_ID}] Failover to {LEADER} took {last_failover['total_ms']:.0f} ms "
+          f"(detect {last_failover['detect_ms']:.0f} ms, elect {last_failover['elect_ms']:.0f} ms)")
 
 def start_election():
     """
@@ -236,164 +1853,375 @@ def start_election():
     - If any higher node answers, wait for coordinator message.
     - If none answer within timeout, become coordinator and broadcast.
     """
-    global LEADER, IS_LEADER
-    print(f"[{NODE_ID}] Starting election")
-    # send /election to nodes with higher ID
-    higher_peers = []
-    for p in PEERS:
-        try:
-            # obtain their id via /status
-            r = requests.get(p + "/status", timeout=1.0)
-            jd = r.json()
-            peer_id = jd['id']
-            if peer_id > NODE_ID:
-                higher_peers.append((peer_id, p))
-        except:
-            pass
+    if not election_lock.acquire(blocking=False):
+        return  # already running one; it will settle who leads
+    started = time.time()
+    outcome = "failed"
+    try:
+        for _ in range(ELECTION_RETRIES):
+            if run_election():
+                outcome = "won" if IS_LEADER else "lost"
+                return
+            print(f"[{NODE_ID}] No coordinator announced, retrying election")
+    finally:
+        election_lock.release()
+        elections.inc(outcome=outcome)
+        election_duration.observe(time.time() - started)
 
-    answers = []
-    # send election messages to higher peers
-    for peer_id, p in higher_peers:
-        try:
-            requests.post(p + "/election", json={"id": NODE_ID, "reply_to": f"http://127.0.0.1:{PORT}"}, timeout=1.0)
-        except:
-            pass
+def run_election():
+    """One Bully round; returns False if a higher node answered but never announced itself."""
+    global LEADER, IS_LEADER, term
+    print(f"[{NODE_ID}] Starting election")
+    answer_event.clear()
+    coordinator_event.clear()
+    learn_peer_ids(timeout=ELECTION_TIMEOUT)
+    higher_peers = [p for p in PEERS if peer_ids.get(p, NODE_ID) > NODE_ID]
 
-    # wait for any answers within a short window
-    wait_until = time.time() + 2.0
-    answered = False
-    # We don't have per-answer bookkeeping; assume if any higher peer responds to /status quickly they're available.
-    # Simpler: poll status of higher peers
-    while time.time() < wait_until:
-        for peer_id, p in higher_peers:
-            try:
-                r = requests.get(p + "/status", timeout=0.5)
-                if r.status_code == 200:
-                    answered = True
-                    break
-            except:
-                continue
-        if answered:
-            break
-        time.sleep(0.2)
+    # send election messages to higher peers; a live higher node answers in its reply and via /answer
+    deadline = time.time() + ELECTION_TIMEOUT
+    results = fan_out("POST", [(p + "/election", {"id": NODE_ID, "reply_to": f"http://127.0.0.1:{PORT}"})
+                               for p in higher_peers], timeout=ELECTION_TIMEOUT)
+    replies = [jd for jd in map(json_or_none, results) if jd]
+    term = max([term] + [jd.get("term", 0) for jd in replies])
+    persist_term()
+    answered = any(jd.get("action") == "sent_answer" for jd in replies)
+    if not answered and any(r is not None for r in results):
+        # only worth waiting if some higher node took the message; dead ones can't answer
+        answered = answer_event.wait(max(0.0, deadline - time.time()))
 
     if not answered:
         # become coordinator
+        term += 1
+        persist_term()  # before anything is stamped with it
         LEADER = f"http://127.0.0.1:{PORT}"
         IS_LEADER = True
-        print(f"[{NODE_ID}] Becoming leader")
+        print(f"[{NODE_ID}] Becoming leader for term {term}")
         # announce to all peers
-        for p in PEERS:
-            try:
-                requests.post(p + "/coordinator", json={"leader_url": LEADER}, timeout=1.0)
-            except:
-                pass
+        fan_out("POST", [(p + "/coordinator", {"leader_url": LEADER, "id": NODE_ID, "term": term}) for p in PEERS])
+        record_failover()
         # As leader, run on_become_leader to collect logs and set state
         threading.Thread(target=on_become_leader).start()
-    else:
-        print(f"[{NODE_ID}] Higher node exists, waiting for coordinator")
+        return True
+    print(f"[{NODE_ID}] Higher node exists, waiting for coordinator")
+    return coordinator_event.wait(COORDINATOR_TIMEOUT)
 
 def on_become_leader():
-    """Called on node that just declared itself leader: gather logs and reconcile state."""
-    global seq_counter, lamport
+    """Called on node that just declared itself leader: adopt a majority's log and make it everyone's."""
+    global lease_start, commit_index, decisions_loaded, reconciled_term
+    lease_start = None  # no linearizable reads until the takeover is complete
+    decisions_loaded = False  # nor a delivered_through past decisions not requeued yet
+    takeover_term = term
     print(f"[{NODE_ID}] Running leader reconciliation")
-    collected_logs = []
-    max_seq = 0
-    max_lamport = 0
-    # pull logs from peers
-    for p in PEERS:
-        try:
-            r = requests.get(p + "/log", timeout=1.0)
-            if r.status_code == 200:
-                jd = r.json()
-                collected_logs.extend(jd.get("log", []))
-                max_lamport = max(max_lamport, jd.get("lamport", 0))
-                max_seq = max(max_seq, jd.get("seq_counter", 0) - 1)
-        except:
-            pass
-    # include our own log
+    # until a majority's logs are in we keep trying, and take no writes
+    waiting = None
+    while IS_LEADER and term == takeover_term:
+        waiting_for = adopt_majority_log(takeover_term)
+        if waiting_for is None:
+            break
+        if waiting_for != waiting:
+            print(f"[{NODE_ID}] Reconciliation {waiting_for}; retrying")
+            waiting = waiting_for
+        time.sleep(REPLICATION_RETRY)
+    if not IS_LEADER or term != takeover_term:
+        return
+    # followers report their progress afresh to this term's leader
+    for r in replicators:
+        r.generation += 1
+        r.match = 0
+    with commit_cond:
+        commit_index = max(commit_index, min(leader_commit, transaction_log.applied_seq))
+    # push our snapshot and the short suffix after it to followers, overwriting whatever
+    # they hold past it (entries of an older term that never committed)
+    generations = [r.generation for r in replicators]
+    takeover = {**heartbeat_fields(), "truncate": True}
+    bodies = {codec: snapshot_payload(codec, takeover) for codec in {peer_codec(r.peer) for r in replicators}}
+    results = fan_out("POST", [(r.peer + "/install_snapshot", bodies[peer_codec(r.peer)]) for r in replicators],
+                      timeout=2.0)
+    rejected = [i for i, res in enumerate(results) if res is not None and res[0] == 415]
+    if rejected:
+        # older followers that only speak JSON
+        json_only_peers.update(replicators[i].peer for i in rejected)
+        retried = fan_out("POST", [(replicators[i].peer + "/install_snapshot", snapshot_payload("json", takeover)) for i in rejected],
+                          timeout=2.0)
+        for i, res in zip(rejected, retried):
+            results[i] = res
+    if SHARD is not None:
+        requeue_decisions()
+    if IS_LEADER and term == takeover_term:
+        # we may have acked the previous leader until we took over; its lease outlives that ack
+        lease_start = max(time.time(), leader_acked_at + LEASE_DURATION)
+        reconciled_term = takeover_term
+    for r, generation, jd in zip(replicators, generations, map(json_or_none, results)):
+        if jd is not None:
+            r.record_reply(jd, generation)
+    advance_commit()
+    print(f"[{NODE_ID}] Leader reconciliation done. seq_counter={seq_counter}, lamport={clock.peek()}")
+
+def adopt_majority_log(takeover_term):
+    """
+    One reconciliation attempt of a takeover. Every committed entry is on a majority, so the
+    most up-to-date log (highest last term, then highest seq) among ours and a majority's
+    holds all of them: it becomes ours, whatever our own log held past the last commit we
+    heard of (`since`). Entries past `since` are stamped with our term, so from now on they
+    are this term's and outrank any log that still holds something else at their seqs.
+    Returns None once done, or what it is waiting for.
+    """
+    global seq_counter
     with log_lock:
-        collected_logs.extend(transaction_log)
-    # deduplicate by seq and sort
-    seq_map = {}
-    for e in collected_logs:
-        seq_map[e['seq']] = e
-    merged = [seq_map[k] for k in sorted(seq_map.keys())]
-    # rebuild local state
-    with log_lock, balances_lock, lamport_lock:
-        transaction_log.clear()
-        balances.clear()
-        for e in merged:
-            transaction_log.append(e)
-            balances[e['from']] -= e['amount']
-            balances[e['to']] += e['amount']
-        lamport = max(lamport, max_lamport) + 1
-        seq_counter = max(seq_counter, (max(seq_map.keys()) + 1) if seq_map else 1)
-    # broadcast a sync to followers (optional)
-    snapshot = get_state_snapshot()
-    for p in PEERS:
+        applied = transaction_log.applied_seq
+        since = min(max(commit_index, leader_commit), applied)
+        ours = (transaction_log.last_term(), applied)
+        our_since_term = transaction_log.term_at(since)
+        keep_prefix = transaction_log.snapshot['seq'] <= since
+    # open every peer's log at once, only past `since`, and read just the most up-to-date one
+    opened = [f.result() for f in [fanout_pool.submit(open_log_stream, p, since, takeover_term) for p in PEERS]]
+    answers = [(p, res) for p, res in zip(PEERS, opened) if res is not None]
+    needed = (len(PEERS) + 1) // 2
+    if len(answers) < needed:
+        for _, (_, _, close) in answers:
+            close()
+        return f"needs {needed} peer logs, got {len(answers)}"
+    best, best_key = None, ours  # ties go to us: no entries to fetch
+    for p, (header, entries, close) in answers:
+        key = (header["last_term"], header["applied_seq"])
+        if key > best_key:
+            best, best_key = (p, header, entries, close), key
+    for p, (_, _, close) in answers:
+        if best is None or p != best[0]:
+            close()
+    max_lamport = max([0] + [header.get("lamport", 0) for _, (header, _, _) in answers])
+    stamp = lambda e: dict(e, term=takeover_term) if e['seq'] > since else e
+    base = None
+    # drain the adopted entries into a column store before taking log_lock, so commits are
+    # not held up by a peer's network reads; the lock only covers swapping the result in
+    if best is None:
+        tail = transaction_log.entries.dicts(transaction_log.entries.bisect(since), len(transaction_log.entries))
+    elif keep_prefix and header_agrees(best[1], since, our_since_term):
+        # its log and ours agree up to `since`: its entries after that are all we need
+        tail, end = best[2], best[1]["applied_seq"]
+    else:
+        best[3]()
         try:
-            requests.post(p + "/sync_state", json=snapshot, timeout=1.0)
-        except:
-            pass
-    print(f"[{NODE_ID}] Leader reconciliation done. seq_counter={seq_counter}, lamport={lamport}")
+            accept = BINARY_TYPE if peer_codec(best[0]) == "binary" else "application/json"
+            r = requests.get(best[0] + "/snapshot", headers={"Accept": accept}, timeout=2.0)
+            # requests has already inflated a deflated response
+            jd = decode_message(r.content, r.headers.get("Content-Type"))
+        except Exception:
+            return f"could not fetch the snapshot of {best[0]}"
+        base, tail = jd["snapshot"], jd.get("log", [])
+        end = max([base['seq']] + [e['seq'] for e in tail[-1:]])
+        if end < best[1]["applied_seq"]:
+            return f"got a short snapshot from {best[0]}"
+        if base['seq'] > since:
+            base = dict(base, term=takeover_term)
+    adopted = ColumnarLog(transaction_log.names)
+    chunk = []
+    for e in tail:
+        chunk.append(stamp(e))
+        if len(chunk) >= LOG_STREAM_CHUNK:
+            adopted.extend(chunk)
+            chunk = []
+    adopted.extend(chunk)
+    if best is not None and base is None and adopted.last_seq(since) != end:
+        return f"the log of {best[0]} ended early"
+    with log_lock:
+        if transaction_log.applied_seq != applied:
+            return "log changed meanwhile"
+        if base is None:
+            # our prefix through `since`, then the adopted entries
+            snapshot = transaction_log.snapshot
+            if snapshot['seq'] > since:
+                snapshot = dict(snapshot, term=takeover_term)
+            store = transaction_log.entries.head(transaction_log.entries.bisect(since))
+            for i in range(0, len(adopted), LOG_STREAM_CHUNK):
+                store.extend(adopted.records(i, min(i + LOG_STREAM_CHUNK, len(adopted))))
+        else:
+            snapshot, store = base, adopted
+        dropped = overwrite_log(snapshot, store)
+        if dropped:
+            print(f"[{NODE_ID}] Dropped {dropped} uncommitted entries not on the adopted log")
+        increment_lamport(received=max_lamport)
+        seq_counter = transaction_log.applied_seq + 1
+    return None
+
+def header_agrees(header, since, since_term):
+    """Whether a peer's /log header shows its log holds the entry we hold at `since`, and what follows it."""
+    return since_term is not None and header["since_term"] == since_term and header["first_seq"] <= since + 1
 
 # Heartbeat thread
+def heartbeat_peers(reps):
+    """Send /heartbeat to the followers of `reps` at once, recording acks and stale-term replies."""
+    sent = time.time()
+    generations = [r.generation for r in reps]
+    for r in reps:
+        r.last_sent = sent
+    results = fan_out("POST", [(r.peer + "/heartbeat", heartbeat_fields()) for r in reps], timeout=HEARTBEAT_INTERVAL)
+    # calls of one fan-out complete together, so the round time bounds each follower's RTT
+    rtt = time.time() - sent
+    for r, generation, res in zip(reps, generations, results):
+        if res is None:
+            continue
+        if res[0] == 200:
+            heartbeat_rtt.observe(rtt, follower=r.peer)
+            r.acked = max(r.acked, sent)
+            r.record_reply(json.loads(res[1]), generation)
+        elif res[0] == 409:
+            step_down(json.loads(res[1]))
+
+def send_heartbeats():
+    """Heartbeat the followers no replication batch has reached within the last interval."""
+    now = time.time()
+    due = [r for r in replicators if now - r.last_sent >= HEARTBEAT_INTERVAL]
+    if due:
+        heartbeat_peers(due)
+
 def heartbeat_monitor():
-    global last_leader_heartbeat
+    global leader_lost_at, leader_lost_detected
     while True:
-        time.sleep(HEARTBEAT_INTERVAL)
+        time.sleep(HEARTBEAT_INTERVAL / 4)
         if IS_LEADER:
-            # as leader, we can optionally send heartbeats by posting to /commit a tiny ping or specific /heartbeat endpoint
-            for p in PEERS:
-                try:
-                    requests.post(p + "/commit", json={"seq": -1, "lamport": increment_lamport(), "from":"__sys__","to":"__sys__","amount":0,"client_txid":"heartbeat"}, timeout=0.5)
-                except:
-                    pass
-        else:
-            # follower: check last heartbeat time or ping leader
-            if LEADER:
-                try:
-                    r = requests.get(LEADER + "/status", timeout=1.0)
-                    if r.status_code == 200:
-                        last_leader_heartbeat = time.time()
-                    else:
-                        # treat as failure
-                        pass
-                except:
-                    pass
-            # if timeout passed, start election
-            if time.time() - last_leader_heartbeat > HEARTBEAT_TIMEOUT:
-                print(f"[{NODE_ID}] Leader heartbeat timed out. Starting election.")
-                last_leader_heartbeat = time.time()
-                threading.Thread(target=start_election).start()
+            send_heartbeats()
+        elif detector.phi() > PHI_THRESHOLD:
+            # follower: the leader has been silent for longer than its history makes plausible
+            print(f"[{NODE_ID}] Leader suspected (phi > {PHI_THRESHOLD}). Starting election.")
+            if LEADER and leader_lost_detected is None:
+                leader_lost_at, leader_lost_detected = detector.last, time.time()
+            detector.reset()
+            threading.Thread(target=start_election).start()
 
 # Simple initializer to seed some balances for demo
 def seed_demo_accounts():
-    with balances_lock:
-        balances['A'] = 100
-        balances['B'] = 100
-        balances['C'] = 100
+    with log_lock:
+        balances.replace({account: 100 for account in ('A', 'B', 'C') if owns(account)})
+        # seeded balances are the base snapshot every replay starts from
+        transaction_log.snapshot = {"seq": 0, "balances": dict(balances.snapshot())}
+        checkpoint_wal(transaction_log.snapshot['balances'])
+
+def recover_from_wal():
+    """Rebuild log and balances from the data directory; returns False if it holds no state yet."""
+    global seq_counter, term
+    snapshot, entries = wal.recover()
+    if snapshot is None:
+        return False
+    with log_lock:
+        transaction_log.install(snapshot, entries)
+        remember_ids(entries)
+        balances.replace(replay(snapshot), seq=transaction_log.applied_seq)
+        seq_counter = transaction_log.applied_seq + 1
+        # no term we take part in from now on may be older than one we saw before
+        term = max(term, wal.load_term(), transaction_log.last_term() or 0)
+    # new events must order after everything already logged
+    increment_lamport(received=max([snapshot.get('lamport', 0)] + [e.get('lamport', 0) for e in entries]))
+    return True
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--id", type=int, required=True)
     parser.add_argument("--port", type=int, required=True)
     parser.add_argument("--peers", type=str, default="")
+    parser.add_argument("--batch-size", type=int, default=REPLICATION_MAX_BATCH)
+    parser.add_argument("--batch-linger", type=float, default=REPLICATION_LINGER)
+    parser.add_argument("--replication-window", type=int, default=REPLICATION_WINDOW,
+                        help="entries in flight per follower before the leader waits for acks")
+    parser.add_argument("--replication-queue", type=int, default=REPLICATION_QUEUE,
+                        help="submissions queued per follower before its backlog is dropped for a catch-up")
+    parser.add_argument("--acks", choices=("quorum", "leader"), default=ACKS,
+                        help="answer clients once a majority applied the entry, or once the leader did")
+    parser.add_argument("--commit-timeout", type=float, default=COMMIT_TIMEOUT,
+                        help="how long a write waits for a majority before answering uncommitted")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY)
+    parser.add_argument("--snapshot-retain", type=int, default=SNAPSHOT_RETAIN)
+    parser.add_argument("--data-dir", type=str, default=None, help="enable the on-disk WAL in this directory")
+    parser.add_argument("--wal-sync-interval", type=float, default=WAL_SYNC_INTERVAL)
+    parser.add_argument("--shard-config", type=str, default=None, help="shards.json for multi-leader mode")
+    parser.add_argument("--shard", type=int, default=None, help="shard this node belongs to")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="serve and fan out to peers on asyncio (needs aiohttp)")
+    parser.add_argument("--txid-memory", type=int, default=TXID_MEMORY, help="client txids kept for deduplication")
+    parser.add_argument("--txid-ttl", type=float, default=TXID_TTL, help="seconds a client txid is deduplicated for")
+    parser.add_argument("--follower-writes", choices=("proxy", "redirect"), default=FOLLOWER_WRITES,
+                        help="proxy writes sent to a follower to the leader, or redirect the client there")
+    parser.add_argument("--lease-duration", type=float, default=LEASE_DURATION,
+                        help="leader lease for linearizable reads, seconds (keep below failover time)")
+    parser.add_argument("--read-wait", type=float, default=READ_WAIT,
+                        help="how long a replica waits to catch up for a read before forwarding it")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL)
+    parser.add_argument("--phi-threshold", type=float, default=PHI_THRESHOLD,
+                        help="suspicion level at which a follower starts an election")
+    parser.add_argument("--election-timeout", type=float, default=ELECTION_TIMEOUT,
+                        help="how long to wait for a higher node to answer, seconds")
+    parser.add_argument("--coordinator-timeout", type=float, default=COORDINATOR_TIMEOUT,
+                        help="how long to wait for the coordinator after an answer, seconds")
+    parser.add_argument("--fanout-timeout", type=float, default=FANOUT_TIMEOUT,
+                        help="default per-call deadline of peer fan-outs, seconds")
+    parser.add_argument("--wire-codec", choices=("binary", "json"), default=WIRE_CODEC,
+                        help="format of log entries sent to peers (peers that reject binary get JSON)")
+    parser.add_argument("--compress-min", type=int, default=COMPRESS_MIN,
+                        help="deflate peer bodies larger than this many bytes (-1 disables)")
+    parser.add_argument("--profiling", action="store_true",
+                        help="enable the /debug/profile sampling profiler endpoint")
     args = parser.parse_args()
     NODE_ID = args.id
     PORT = args.port
     if args.peers:
         PEERS = [p for p in args.peers.split(",") if p]
+    if args.shard_config:
+        with open(args.shard_config) as f:
+            SHARDS = [s["nodes"] for s in sorted(json.load(f), key=lambda s: s["shard"])]
+        SHARD = args.shard
+        if not args.peers:
+            # our replicas are the other nodes of our shard
+            PEERS = [u for u in SHARDS[SHARD] if not u.endswith(f":{PORT}")]
+        threading.Thread(target=decision_sender, daemon=True).start()
+    REPLICATION_MAX_BATCH = args.batch_size
+    REPLICATION_LINGER = args.batch_linger
+    REPLICATION_WINDOW = args.replication_window
+    REPLICATION_QUEUE = args.replication_queue
+    ACKS = args.acks
+    COMMIT_TIMEOUT = args.commit_timeout
+    SNAPSHOT_EVERY = args.snapshot_every
+    SNAPSHOT_RETAIN = args.snapshot_retain
+    FANOUT_TIMEOUT = args.fanout_timeout
+    PROFILING = args.profiling
+    WIRE_CODEC = args.wire_codec
+    COMPRESS_MIN = args.compress_min if args.compress_min >= 0 else None
+    txids = TxidCache(args.txid_memory, args.txid_ttl)
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    PHI_THRESHOLD = args.phi_threshold
+    FOLLOWER_WRITES = args.follower_writes
+    LEASE_DURATION = args.lease_duration
+    READ_WAIT = args.read_wait
+    detector = PhiAccrualDetector(HEARTBEAT_INTERVAL)
+    ELECTION_TIMEOUT = args.election_timeout
+    COORDINATOR_TIMEOUT = args.coordinator_timeout
+    if args.async_mode:
+        from bank_async import AsyncRuntime
+        async_runtime = AsyncRuntime()
+
+    replicators = [PeerReplicator(p) for p in PEERS]
+    for r in replicators:
+        r.start()
     # initially unknown leader
     LEADER = None
     IS_LEADER = False
 
-    seed_demo_accounts()
+    if args.data_dir:
+        wal = WriteAheadLog(args.data_dir, args.wal_sync_interval)
+        t0 = time.time()
+        if recover_from_wal():
+            print(f"[{NODE_ID}] Recovered {len(transaction_log)} entries up to seq "
+                  f"{transaction_log.applied_seq} from {args.data_dir} in {(time.time() - t0) * 1000:.1f} ms")
+        else:
+            seed_demo_accounts()
+        wal.start()
+        atexit.register(wal.close)
+    else:
+        seed_demo_accounts()
 
     # start heartbeat monitor thread
     th = threading.Thread(target=heartbeat_monitor, daemon=True)
     th.start()
+    threading.Thread(target=snapshot_monitor, daemon=True).start()
 
     # start flask app
     print(f"Starting node {NODE_ID} on port {PORT} with peers {PEERS}")
@@ -401,17 +2229,12 @@ if __name__ == "__main__":
     def startup_election_check():
         time.sleep(1.0)
         # trivial heuristic: if our ID is the highest among those reachable, become leader
-        highest = NODE_ID
-        for p in PEERS:
-            try:
-                r = requests.get(p + "/status", timeout=1.0)
-                if r.status_code == 200:
-                    jd = r.json()
-                    highest = max(highest, jd['id'])
-            except:
-                pass
-        if NODE_ID >= highest:
+        learn_peer_ids()
+        if NODE_ID >= max(peer_ids.values(), default=NODE_ID):
             threading.Thread(target=start_election).start()
     threading.Thread(target=startup_election_check, daemon=True).start()
 
-    app.run(port=PORT, threaded=True)
+    if async_runtime is not None:
+        async_runtime.serve(app, "127.0.0.1", PORT)
+    else:
+        app.run(port=PORT, threaded=True)
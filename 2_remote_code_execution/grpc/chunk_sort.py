@@ -0,0 +1,111 @@
+# chunk_sort.py
+# Sorting behind the SortStream RPC (grpc_server.py). Incoming chunks of packed float64 are
+# copied into one buffer of at most `memory` bytes. If the whole input fits it is sorted in
+# place with NumPy and streamed back; otherwise every time the buffer fills it is sorted and
+# written out as a run file, and the output is a k-way merge of the runs.
+#
+# The merge works a block at a time rather than value by value: with a block loaded from
+# each run, every value up to the smallest of the blocks' last values is known to be in
+# memory, so those prefixes are cut out with searchsorted, merged by one NumPy sort and
+# emitted, and the run that supplied the cutoff advances by a whole block.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+DTYPE = np.dtype("<f8")
+
+class ExternalSorter:
+    """Collects values with add(), then yields them in ascending order from sorted_chunks()."""
+
+    def __init__(self, memory=256 << 20, spill_dir=None):
+        self.capacity = max(2, memory // DTYPE.itemsize)
+        self.buffer = np.empty(self.capacity, DTYPE)  # untouched pages cost nothing until filled
+        self.size = 0
+        self.count = 0
+        self.spill_dir = spill_dir
+        self.tmp = None
+        self.runs = []  # (path, number of values)
+
+    def add(self, data):
+        """Append the values packed in `data`; ValueError if it is not whole float64s."""
+        if len(data) % DTYPE.itemsize:
+            raise ValueError(f"chunk of {len(data)} bytes is not a whole number of float64 values")
+        values = np.frombuffer(data, DTYPE)
+        self.count += len(values)
+        while len(values):
+            if self.size == self.capacity:
+                self.spill()
+            take = min(len(values), self.capacity - self.size)
+            self.buffer[self.size:self.size + take] = values[:take]
+            self.size += take
+            values = values[take:]
+
+    def spill(self):
+        run = self.buffer[:self.size]
+        run.sort()
+        if self.tmp is None:
+            self.tmp = tempfile.mkdtemp(prefix="sortstream_", dir=self.spill_dir)
+        path = os.path.join(self.tmp, f"run{len(self.runs)}.f8")
+        run.tofile(path)
+        self.runs.append((path, self.size))
+        self.size = 0
+
+    def sorted_chunks(self, chunk_values=1 << 16):
+        """Every value added, ascending (NaN last), as arrays of at most chunk_values."""
+        if not self.runs:
+            blocks = [self.buffer[:self.size]]
+            blocks[0].sort()
+        else:
+            if self.size:
+                self.spill()
+            self.buffer = None  # the merge needs the memory
+            blocks = self.merge()
+        for block in blocks:
+            for i in range(0, len(block), chunk_values):
+                yield block[i:i + chunk_values]
+
+    def merge(self):
+        # runs are read into per-run buffers rather than memory-mapped, so what the merge
+        # holds stays within the budget instead of growing with the pages it has touched
+        files = [open(path, "rb") for path, _ in self.runs]
+        left = [n for _, n in self.runs]
+        loaded = [np.empty(0, DTYPE) for _ in self.runs]
+        # a quarter of the budget for the loaded blocks; the rest covers their merged copy, the
+        # previous copy still being sent and the sort's scratch space
+        block = max(1, self.capacity // 4 // len(self.runs))
+        try:
+            while True:
+                for i, f in enumerate(files):
+                    want = min(block - len(loaded[i]), left[i])
+                    if want > 0:
+                        more = np.fromfile(f, DTYPE, count=want)
+                        loaded[i] = np.concatenate((loaded[i], more)) if len(loaded[i]) else more
+                        left[i] -= len(more)
+                live = [i for i in range(len(files)) if len(loaded[i])]
+                if not live:
+                    return
+                lasts = np.array([loaded[i][-1] for i in live])
+                all_nan = np.isnan(lasts).all()
+                cutoff = None if all_nan else np.nanmin(lasts)
+                parts = []
+                for i in live:
+                    b = loaded[i]
+                    k = len(b) if all_nan else int(np.searchsorted(b, cutoff, side="right"))
+                    parts.append(b[:k])
+                    loaded[i] = b[k:]
+                out = np.concatenate(parts)
+                parts = None
+                out.sort(kind="stable")  # timsort: merges the already sorted parts
+                yield out
+        finally:
+            for f in files:
+                f.close()
+
+    def close(self):
+        """Delete the run files; safe to call more than once."""
+        self.buffer = None
+        if self.tmp is not None:
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
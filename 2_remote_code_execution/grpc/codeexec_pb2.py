@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x63odeexec.proto\"(\n\nTwoNumbers\x12\x0c\n\x04num1\x18\x01 \x01(\x02\x12\x0c\n\x04num2\x18\x02 \x01(\x02\"\x1a\n\nNumberList\x12\x0c\n\x04nums\x18\x01 \x03(\x02\"\x1a\n\nListResult\x12\x0c\n\x04nums\x18\x01 \x03(\x02\"\x15\n\x04Text\x12\r\n\x05value\x18\x01 \x01(\t\"\x17\n\x06Result\x12\r\n\x05value\x18\x01 \x01(\x02\x32y\n\x08\x43odeExec\x12\x1b\n\x03\x41\x64\x64\x12\x0b.TwoNumbers\x1a\x07.Result\x12 \n\x04Sort\x12\x0b.NumberList\x1a\x0b.ListResult\x12\x15\n\x05Upper\x12\x05.Text\x1a\x05.Text\x12\x17\n\x07Reverse\x12\x05.Text\x1a\x05.Textb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0e\x63odeexec.proto\"(\n\nTwoNumbers\x12\x0c\n\x04num1\x18\x01 \x01(\x02\x12\x0c\n\x04num2\x18\x02 \x01(\x02\"\x1a\n\nNumberList\x12\x0c\n\x04nums\x18\x01 \x03(\x02\"\x1a\n\nListResult\x12\x0c\n\x04nums\x18\x01 \x03(\x02\"\x15\n\x04Text\x12\r\n\x05value\x18\x01 \x01(\t\"\x17\n\x06Result\x12\r\n\x05value\x18\x01 \x01(\x02\"\x8a\x01\n\x0b\x45xecRequest\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x1a\n\x03\x61\x64\x64\x18\x02 \x01(\x0b\x32\x0b.TwoNumbersH\x00\x12\x1b\n\x04sort\x18\x03 \x01(\x0b\x32\x0b.NumberListH\x00\x12\x16\n\x05upper\x18\x04 \x01(\x0b\x32\x05.TextH\x00\x12\x18\n\x07reverse\x18\x05 \x01(\x0b\x32\x05.TextH\x00\x42\x04\n\x02op\"\x9c\x01\n\x0c\x45xecResponse\x12\n\n\x02id\x18\x01 \x01(\x04\x12\x16\n\x03\x61\x64\x64\x18\x02 \x01(\x0b\x32\x07.ResultH\x00\x12\x1b\n\x04sort\x18\x03 \x01(\x0b\x32\x0b.ListResultH\x00\x12\x16\n\x05upper\x18\x04 \x01(\x0b\x32\x05.TextH\x00\x12\x18\n\x07reverse\x18\x05 \x01(\x0b\x32\x05.TextH\x00\x12\x0f\n\x05\x65rror\x18\x06 \x01(\tH\x00\x42\x08\n\x06result\"\x1a\n\nFloatChunk\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\x32\xd1\x01\n\x08\x43odeExec\x12\x1b\n\x03\x41\x64\x64\x12\x0b.TwoNumbers\x1a\x07.Result\x12 \n\x04Sort\x12\x0b.NumberList\x1a\x0b.ListResult\x12\x15\n\x05Upper\x12\x05.Text\x1a\x05.Text\x12\x17\n\x07Reverse\x12\x05.Text\x1a\x05.Text\x12*\n\x07\x45xecute\x12\x0c.ExecRequest\x1a\r.ExecResponse(\x01\x30\x01\x12*\n\nSortStream\x12\x0b.FloatChunk\x1a\x0b.FloatChunk(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -41,6 +41,12 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_TEXT']._serialized_end=137
   _globals['_RESULT']._serialized_start=139
   _globals['_RESULT']._serialized_end=162
-  _globals['_CODEEXEC']._serialized_start=164
-  _globals['_CODEEXEC']._serialized_end=285
+  _globals['_EXECREQUEST']._serialized_start=165
+  _globals['_EXECREQUEST']._serialized_end=303
+  _globals['_EXECRESPONSE']._serialized_start=306
+  _globals['_EXECRESPONSE']._serialized_end=462
+  _globals['_FLOATCHUNK']._serialized_start=464
+  _globals['_FLOATCHUNK']._serialized_end=490
+  _globals['_CODEEXEC']._serialized_start=493
+  _globals['_CODEEXEC']._serialized_end=702
 # @@protoc_insertion_point(module_scope)
@@ -54,6 +54,16 @@ class CodeExecStub(object):
                 request_serializer=codeexec__pb2.Text.SerializeToString,
                 response_deserializer=codeexec__pb2.Text.FromString,
                 _registered_method=True)
+        self.Execute = channel.stream_stream(
+                '/CodeExec/Execute',
+                request_serializer=codeexec__pb2.ExecRequest.SerializeToString,
+                response_deserializer=codeexec__pb2.ExecResponse.FromString,
+                _registered_method=True)
+        self.SortStream = channel.stream_stream(
+                '/CodeExec/SortStream',
+                request_serializer=codeexec__pb2.FloatChunk.SerializeToString,
+                response_deserializer=codeexec__pb2.FloatChunk.FromString,
+                _registered_method=True)
 
 
 class CodeExecServicer(object):
@@ -83,6 +93,22 @@ class CodeExecServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Execute(self, request_iterator, context):
+        """Any number of the operations above over one stream. Responses carry the id of the
+        request they answer; a client may send many requests before reading any response.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SortStream(self, request_iterator, context):
+        """Sort of inputs too large for one message: the client streams its values in chunks and
+        half-closes; the server then streams all of them back in ascending order.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_CodeExecServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -106,6 +132,16 @@ def add_CodeExecServicer_to_server(servicer, server):
                     request_deserializer=codeexec__pb2.Text.FromString,
                     response_serializer=codeexec__pb2.Text.SerializeToString,
             ),
+            'Execute': grpc.stream_stream_rpc_method_handler(
+                    servicer.Execute,
+                    request_deserializer=codeexec__pb2.ExecRequest.FromString,
+                    response_serializer=codeexec__pb2.ExecResponse.SerializeToString,
+            ),
+            'SortStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.SortStream,
+                    request_deserializer=codeexec__pb2.FloatChunk.FromString,
+                    response_serializer=codeexec__pb2.FloatChunk.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'CodeExec', rpc_method_handlers)
@@ -224,3 +260,57 @@ class CodeExec(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def Execute(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/CodeExec/Execute',
+            codeexec__pb2.ExecRequest.SerializeToString,
+            codeexec__pb2.ExecResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SortStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/CodeExec/SortStream',
+            codeexec__pb2.FloatChunk.SerializeToString,
+            codeexec__pb2.FloatChunk.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
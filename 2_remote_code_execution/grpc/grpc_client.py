@@ -1,40 +1,295 @@
 # grpc_client.py
+# python grpc_client.py                  5 threads, 4 random unary calls each
+# python grpc_client.py --stream         the same operations over one Execute stream per thread
+# python grpc_client.py --bench 20000    throughput of unary calls vs the Execute stream
+# python grpc_client.py --overload 2000 --size 2000 --deadline 0.5
+#                                        open-loop Sort calls at a fixed rate; latency and status counts
+# python grpc_client.py --sort 100000000  stream that many random float64s through SortStream
+#                                        and check the result comes back complete and ascending
+# python grpc_client.py --flood 2000 --size 20000
+#                                        that many Sort operations at once on one Execute stream;
+#                                        against grpc_server.py --aio with a small --max-concurrent
+#                                        and --max-queue some are shed, and each must still be answered
 import grpc
 import codeexec_pb2
 import codeexec_pb2_grpc
-from threading import Thread
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from threading import Thread, Lock, BoundedSemaphore
+import argparse
+import itertools
+import queue
 import random
 import time
 
+TARGET = 'localhost:50051'
+
+class ExecuteStream:
+    """
+    One bidirectional Execute stream. submit() sends an operation without waiting and returns
+    a Future, resolved when the response carrying its id arrives. At most `window` operations
+    are in flight; submit() blocks beyond that instead of queueing without limit.
+    """
+
+    def __init__(self, stub, window=256):
+        self.outbox = queue.Queue()
+        self.pending = {}
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(window)
+        self.ids = itertools.count(1)
+        self.error = None
+        self.responses = stub.Execute(iter(self.outbox.get, None))
+        self.reader = Thread(target=self.read, daemon=True)
+        self.reader.start()
+
+    def submit(self, op, message):
+        """op is an ExecRequest field name: "add", "sort", "upper" or "reverse"."""
+        self.slots.acquire()
+        future = Future()
+        rid = next(self.ids)
+        with self.lock:
+            if self.error is not None:
+                self.slots.release()
+                raise self.error
+            self.pending[rid] = future
+        self.outbox.put(codeexec_pb2.ExecRequest(id=rid, **{op: message}))
+        return future
+
+    def read(self):
+        try:
+            for response in self.responses:
+                with self.lock:
+                    future = self.pending.pop(response.id, None)
+                if future is None:
+                    continue
+                self.slots.release()
+                kind = response.WhichOneof("result")
+                if kind == "error":
+                    future.set_exception(RuntimeError(response.error))
+                else:
+                    future.set_result(getattr(response, kind))
+            error = RuntimeError("Execute stream closed")
+        except grpc.RpcError as e:
+            error = e
+        with self.lock:
+            self.error = error
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            self.slots.release()
+            future.set_exception(error)
+
+    def close(self):
+        """Half-close the stream and wait for the outstanding responses."""
+        self.outbox.put(None)
+        self.reader.join()
+
+def random_op(cid):
+    op = random.choice(["Add", "Sort", "Upper", "Reverse"])
+    if op == "Add":
+        return op, codeexec_pb2.TwoNumbers(num1=cid, num2=random.randint(1,10))
+    elif op == "Sort":
+        return op, codeexec_pb2.NumberList(nums=[random.randint(1, 100) for _ in range(5)])
+    elif op == "Upper":
+        return op, codeexec_pb2.Text(value="hello grpc")
+    return op, codeexec_pb2.Text(value="grpc engine")
+
 def worker(cid):
-    channel = grpc.insecure_channel('localhost:50051')
+    channel = grpc.insecure_channel(TARGET)
     stub = codeexec_pb2_grpc.CodeExecStub(channel)
 
     for _ in range(4):
-        op = random.choice(["Add", "Sort", "Upper", "Reverse"])
+        op, req = random_op(cid)
+        res = getattr(stub, op)(req)
+        print(f"[CLIENT {cid}] {op} => {res}")
+        time.sleep(0.4)
+
+def stream_worker(cid):
+    channel = grpc.insecure_channel(TARGET)
+    stream = ExecuteStream(codeexec_pb2_grpc.CodeExecStub(channel))
+
+    # all four go out back to back; the responses are matched up by id
+    sent = [random_op(cid) for _ in range(4)]
+    results = [stream.submit(op.lower(), req) for op, req in sent]
+    for (op, _), fut in zip(sent, results):
+        print(f"[CLIENT {cid}] {op} => {fut.result()}")
+    stream.close()
+
+# --------------------------------------
+# THROUGHPUT: unary round trips vs one Execute stream
+# --------------------------------------
+def bench(n, threads, window):
+    ops = [random_op(i) for i in range(n)]
+    channel = grpc.insecure_channel(TARGET)
+    stub = codeexec_pb2_grpc.CodeExecStub(channel)
+    grpc.channel_ready_future(channel).result(timeout=10)
 
-        if op == "Add":
-            req = codeexec_pb2.TwoNumbers(num1=cid, num2=random.randint(1,10))
-            res = stub.Add(req)
+    def unary(batch):
+        for op, req in batch:
+            getattr(stub, op)(req)
 
-        elif op == "Sort":
-            nums = [random.randint(1, 100) for _ in range(5)]
-            res = stub.Sort(codeexec_pb2.NumberList(nums=nums))
+    def unary_threads():
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(unary, [ops[i::threads] for i in range(threads)]))
 
-        elif op == "Upper":
-            res = stub.Upper(codeexec_pb2.Text(value="hello grpc"))
+    def stream():
+        s = ExecuteStream(stub, window)
+        futures = [s.submit(op.lower(), req) for op, req in ops]
+        for fut in futures:
+            fut.result()
+        s.close()
 
+    results = []
+    for name, run in [("unary, 1 thread", lambda: unary(ops)),
+                      (f"unary, {threads} threads", unary_threads),
+                      (f"Execute stream, window {window}", stream)]:
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        results.append((name, n / elapsed))
+        print(f"{name:<30} {n} ops in {elapsed:7.3f}s  {n / elapsed:10.0f} ops/s")
+    base = results[0][1]
+    print(f"stream vs sequential unary: {results[2][1] / base:.1f}x, "
+          f"vs {threads}-thread unary: {results[2][1] / results[1][1]:.1f}x")
+
+# --------------------------------------
+# OVERLOAD: Sort calls at a fixed rate, whether or not the server keeps up
+# --------------------------------------
+def overload(rate, duration, size, deadline):
+    channel = grpc.insecure_channel(TARGET)
+    stub = codeexec_pb2_grpc.CodeExecStub(channel)
+    grpc.channel_ready_future(channel).result(timeout=10)
+    req = codeexec_pb2.NumberList(nums=[random.random() for _ in range(size)])
+    lock = Lock()
+    latencies = []
+    statuses = {}
+
+    def done(fut, start):
+        code = fut.code()
+        with lock:
+            statuses[code.name] = statuses.get(code.name, 0) + 1
+            if code == grpc.StatusCode.OK:
+                latencies.append(time.perf_counter() - start)
+
+    calls = []
+    t0 = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = t0 + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.perf_counter()
+        fut = stub.Sort.future(req, timeout=deadline)
+        fut.add_done_callback(lambda f, start=start: done(f, start))
+        calls.append(fut)
+    for fut in calls:
+        fut.exception()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float("nan")
+    print(f"offered {rate:.0f}/s for {duration}s, Sort of {size} floats, deadline {deadline}s")
+    print(f"completed {len(latencies) / elapsed:.0f}/s   statuses {statuses}")
+    print(f"latency ms  p50 {pct(0.5):.1f}  p99 {pct(0.99):.1f}  max {pct(1.0):.1f}")
+
+# --------------------------------------
+# FLOOD: more Execute operations at once than the server admits
+# --------------------------------------
+def flood(n, size, wait=60.0):
+    channel = grpc.insecure_channel(TARGET)
+    stub = codeexec_pb2_grpc.CodeExecStub(channel)
+    grpc.channel_ready_future(channel).result(timeout=10)
+    # a few distinct requests, so the result cache (on by default) answers the repeats
+    reqs = [codeexec_pb2.NumberList(nums=[random.random() for _ in range(size)]) for _ in range(8)]
+    stream = ExecuteStream(stub, window=n)
+    t0 = time.perf_counter()
+    futures = [stream.submit("sort", reqs[i % len(reqs)]) for i in range(n)]
+    counts = {}
+    end = t0 + wait
+    for fut in futures:
+        try:
+            error = fut.exception(timeout=max(0.0, end - time.perf_counter()))
+        except FutureTimeout:
+            error = TimeoutError(f"no response within {wait}s")
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, RuntimeError) and str(error).split(":")[0] in ("RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED"):
+            outcome = str(error).split(":")[0]
         else:
-            res = stub.Reverse(codeexec_pb2.Text(value="grpc engine"))
+            outcome = "lost"   # never answered, or the stream failed
+        counts[outcome] = counts.get(outcome, 0) + 1
+    print(f"{n} Sort operations of {size} floats in {time.perf_counter() - t0:.2f}s: {counts}")
+    if counts.get("lost"):
+        raise SystemExit(f"{counts['lost']} operations got no response (stream error: {stream.error})")
+    stream.close()
 
-        print(f"[CLIENT {cid}] {op} => {res}")
-        time.sleep(0.4)
+# --------------------------------------
+# SORTSTREAM: chunked sort of an input too large for one message (needs numpy)
+# --------------------------------------
+def sort_stream(n, chunk_values):
+    import numpy as np
+    channel = grpc.insecure_channel(TARGET)
+    stub = codeexec_pb2_grpc.CodeExecStub(channel)
+    rng = np.random.default_rng()
+    # order-independent checksum: sum of the values' bit patterns mod 2**64
+    checksum = lambda values: int(values.view("<u8").sum(dtype=np.uint64))
+    sent = [0]
+
+    def chunks():
+        left = n
+        while left:
+            values = rng.standard_normal(min(left, chunk_values))
+            sent[0] += checksum(values)
+            left -= len(values)
+            yield codeexec_pb2.FloatChunk(data=values.tobytes())
+
+    t0 = time.perf_counter()
+    first = None
+    count = received = 0
+    last = -np.inf
+    ascending = True
+    for chunk in stub.SortStream(chunks()):
+        if first is None:
+            first = time.perf_counter() - t0
+        values = np.frombuffer(chunk.data, "<f8")
+        if len(values):
+            ascending = ascending and values[0] >= last and bool(np.all(values[1:] >= values[:-1]))
+            last = values[-1]
+        count += len(values)
+        received += checksum(values)
+    elapsed = time.perf_counter() - t0
+    complete = count == n and received % 2**64 == sent[0] % 2**64
+    print(f"sorted {count} values in {elapsed:.2f}s ({n / elapsed / 1e6:.2f}M values/s, "
+          f"first chunk back after {first or 0:.2f}s)  ascending={ascending}  complete={complete}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default=TARGET)
+    parser.add_argument("--stream", action="store_true", help="demo over Execute streams")
+    parser.add_argument("--bench", type=int, metavar="N", help="time N operations each way")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent unary callers in --bench")
+    parser.add_argument("--window", type=int, default=256, help="max in-flight operations per stream")
+    parser.add_argument("--overload", type=float, metavar="RATE", help="open-loop Sort calls per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="--overload: seconds")
+    parser.add_argument("--size", type=int, default=1000, help="--overload, --flood: floats per Sort")
+    parser.add_argument("--deadline", type=float, default=1.0, help="--overload: per-call deadline in seconds")
+    parser.add_argument("--sort", type=int, metavar="N", help="SortStream N random values")
+    parser.add_argument("--chunk", type=int, default=1 << 17, help="--sort: values per chunk sent")
+    parser.add_argument("--flood", type=int, metavar="N", help="N Sort operations at once on one Execute stream")
+    args = parser.parse_args()
+    TARGET = args.target
 
-threads = []
-for cid in range(1, 6):
-    t = Thread(target=worker, args=(cid,))
-    t.start()
-    threads.append(t)
+    if args.bench:
+        bench(args.bench, args.threads, args.window)
+    elif args.overload:
+        overload(args.overload, args.duration, args.size, args.deadline)
+    elif args.sort:
+        sort_stream(args.sort, args.chunk)
+    elif args.flood:
+        flood(args.flood, args.size)
+    else:
+        threads = []
+        for cid in range(1, 6):
+            t = Thread(target=stream_worker if args.stream else worker, args=(cid,))
+            t.start()
+            threads.append(t)
 
-for t in threads:
-    t.join()
+        for t in threads:
+            t.join()
@@ -1,37 +1,397 @@
 # grpc_server.py
+# python grpc_server.py                                   thread pool server (default)
+# python grpc_server.py --aio --max-concurrent 8 --max-queue 32
+#   asyncio server: at most --max-concurrent operations run at once and --max-queue wait for
+#   a slot; calls beyond that get RESOURCE_EXHAUSTED immediately, and calls whose deadline
+#   passes before they start get DEADLINE_EXCEEDED without running.
+# SortStream (chunked sort of large inputs) needs numpy; --sort-memory bounds what one sort
+# holds in memory before it spills sorted runs to --spill-dir.
+# Add, Sort, Upper and Reverse (alone or in Execute) run in a pool of --procs worker
+# processes under per-task limits (../worker_pool.py); --procs 0 runs them in the server.
+# Their responses are cached (../result_cache.py, --cache-mb, --cache-ttl; --cache-mb 0: off)
+# and a repeated request is answered with the response bytes serialized the first time.
 import grpc
 from concurrent import futures
+import argparse
+import asyncio
+import functools
+import os
+import sys
 import threading
 
 import codeexec_pb2
 import codeexec_pb2_grpc
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from worker_pool import TASKS, TaskFailed, WorkerPool
+from result_cache import ResultCache
+
+SORT_MEMORY = 256 << 20   # bytes of values one SortStream keeps in memory before spilling runs
+SPILL_DIR = None          # where spilled runs go (None: the system temp directory)
+SORT_CHUNK = 1 << 16      # values per FloatChunk sent back (512 KiB)
+POOL = None               # worker_pool.WorkerPool unless started with --procs 0
+CACHE = None              # result_cache.ResultCache unless started with --cache-mb 0
+
+# TaskFailed.kind -> status of the failed call
+TASK_STATUS = {"error": grpc.StatusCode.INVALID_ARGUMENT, "unknown": grpc.StatusCode.UNIMPLEMENTED,
+               "cpu": grpc.StatusCode.RESOURCE_EXHAUSTED, "memory": grpc.StatusCode.RESOURCE_EXHAUSTED,
+               "timeout": grpc.StatusCode.DEADLINE_EXCEEDED, "crash": grpc.StatusCode.INTERNAL}
+
+# --------------------------------------
+# OPERATIONS (shared by the unary RPCs and Execute)
+# --------------------------------------
+def run_task(task_type, data):
+    """A worker_pool task, in the pool when there is one; raises TaskFailed there."""
+    if POOL is not None:
+        return POOL.run(task_type, data)
+    return TASKS[task_type](data)
+
+def add(request):
+    return codeexec_pb2.Result(value=run_task("add", [request.num1, request.num2]))
+
+def sort(request):
+    return codeexec_pb2.ListResult(nums=run_task("sort", list(request.nums)))
+
+def upper(request):
+    return codeexec_pb2.Text(value=run_task("uppercase", request.value))
+
+def reverse(request):
+    return codeexec_pb2.Text(value=run_task("reverse", request.value))
+
+# ExecRequest.op / ExecResponse.result field name -> operation
+OPERATIONS = {"add": add, "sort": sort, "upper": upper, "reverse": reverse}
+
+# unary method -> (operation, request type)
+UNARY = {"Add": ("add", codeexec_pb2.TwoNumbers), "Sort": ("sort", codeexec_pb2.NumberList),
+         "Upper": ("upper", codeexec_pb2.Text), "Reverse": ("reverse", codeexec_pb2.Text)}
+
+def run_op(op, request):
+    """
+    OPERATIONS[op](request). With a result cache the answer is the serialized response
+    instead, taken from the cache when an identical request was answered before.
+    """
+    if CACHE is None:
+        return OPERATIONS[op](request)
+    key = CACHE.key(op, request.SerializeToString(deterministic=True))
+    body = CACHE.get(key)
+    if body is None:
+        body = OPERATIONS[op](request).SerializeToString()
+        CACHE.put(key, body)
+    return body
+
+def varint(n):
+    out = bytearray()
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def exec_response(rid, op, body):
+    """
+    A serialized ExecResponse around an already-serialized result. On the wire a message
+    field is its tag, its length and its bytes, so the result is not parsed again.
+    """
+    field = codeexec_pb2.ExecResponse.DESCRIPTOR.fields_by_name[op].number
+    return varint(1 << 3) + varint(rid) + varint(field << 3 | 2) + varint(len(body)) + body
+
+def error_response(rid, error):
+    """An ExecResponse carrying `error`; serialized when there is a result cache, like execute()'s."""
+    response = codeexec_pb2.ExecResponse(id=rid, error=error)
+    return response if CACHE is None else response.SerializeToString()
+
+def execute(request):
+    """The ExecResponse answering one ExecRequest; serialized when there is a result cache."""
+    op = request.WhichOneof("op")
+    if op is None:
+        return error_response(request.id, "no operation set")
+    try:
+        result = run_op(op, getattr(request, op))
+    except Exception as e:
+        return error_response(request.id, f"{op} failed: {e}")
+    if CACHE is not None:
+        return exec_response(request.id, op, result)
+    return codeexec_pb2.ExecResponse(id=request.id, **{op: result})
+
+def next_chunk(chunks):
+    """The next FloatChunk of a sorted_chunks() generator, or None at the end."""
+    values = next(chunks, None)
+    return None if values is None else codeexec_pb2.FloatChunk(data=values.tobytes())
+
 class CodeExecServicer(codeexec_pb2_grpc.CodeExecServicer):
 
+    def call(self, op, request, context):
+        try:
+            return run_op(op, request)
+        except TaskFailed as e:
+            context.abort(TASK_STATUS[e.kind], str(e))
+
     def Add(self, request, context):
         print(f"[THREAD {threading.get_ident()}] Handling Add")
-        return codeexec_pb2.Result(value=request.num1 + request.num2)
+        return self.call("add", request, context)
 
     def Sort(self, request, context):
         print(f"[THREAD {threading.get_ident()}] Handling Sort")
-        nums = sorted(list(request.nums))
-        return codeexec_pb2.ListResult(nums=nums)
+        return self.call("sort", request, context)
 
     def Upper(self, request, context):
         print(f"[THREAD {threading.get_ident()}] Handling Upper")
-        return codeexec_pb2.Text(value=request.value.upper())
+        return self.call("upper", request, context)
 
     def Reverse(self, request, context):
         print(f"[THREAD {threading.get_ident()}] Handling Reverse")
-        return codeexec_pb2.Text(value=request.value[::-1])
+        return self.call("reverse", request, context)
+
+    def Execute(self, request_iterator, context):
+        # one line per stream, not per operation: a stream may carry thousands of them
+        print(f"[THREAD {threading.get_ident()}] Handling Execute stream from {context.peer()}")
+        count = 0
+        for request in request_iterator:
+            count += 1
+            yield execute(request)
+        print(f"[THREAD {threading.get_ident()}] Execute stream done, {count} operations")
+
+    def SortStream(self, request_iterator, context):
+        from chunk_sort import ExternalSorter
+        print(f"[THREAD {threading.get_ident()}] Handling SortStream")
+        sorter = ExternalSorter(SORT_MEMORY, SPILL_DIR)
+        context.add_callback(sorter.close)  # runs even if the client goes away mid-stream
+        try:
+            try:
+                for chunk in request_iterator:
+                    sorter.add(chunk.data)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+            for values in sorter.sorted_chunks(SORT_CHUNK):
+                yield codeexec_pb2.FloatChunk(data=values.tobytes())
+            print(f"[THREAD {threading.get_ident()}] SortStream done, {sorter.count} values, "
+                  f"{len(sorter.runs)} runs spilled")
+        finally:
+            sorter.close()
+
+# --------------------------------------
+# ASYNCIO SERVER WITH ADMISSION CONTROL
+# --------------------------------------
+class Rejected(Exception):
+    """A call refused before it ran; carries the status to answer with."""
+
+    def __init__(self, code, details):
+        super().__init__(details)
+        self.code = code
+        self.details = details
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    codeexec_pb2_grpc.add_CodeExecServicer_to_server(CodeExecServicer(), server)
-    server.add_insecure_port('[::]:50051')
-    print("🚀 gRPC Server running on port 50051...")
+class Admission:
+    """
+    Bounds the work the event loop accepts. Up to `limit` operations run at once in a
+    `limit`-thread executor (so the loop stays free to accept and refuse calls) and up to
+    `backlog` more wait for a slot. A call arriving with the backlog full is shed, and one
+    whose deadline passes before it gets a slot is dropped, so queueing delay cannot grow
+    beyond what the backlog allows.
+    """
+
+    def __init__(self, limit, backlog):
+        self.slots = asyncio.Semaphore(limit)
+        self.backlog = backlog
+        self.waiting = 0
+        self.executor = futures.ThreadPoolExecutor(max_workers=limit)
+        self.counts = {"ran": 0, "shed": 0, "expired": 0}
+
+    async def acquire(self, remaining):
+        """Wait for a slot; raises Rejected instead. `remaining` is the caller's time left in seconds, or None."""
+        if remaining is not None and remaining <= 0:
+            self.counts["expired"] += 1
+            raise Rejected(grpc.StatusCode.DEADLINE_EXCEEDED, "deadline expired before the call started")
+        if self.slots.locked() and self.waiting >= self.backlog:
+            self.counts["shed"] += 1
+            raise Rejected(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                           f"server overloaded: {self.waiting} calls already waiting")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), remaining)
+        except TimeoutError:
+            self.counts["expired"] += 1
+            raise Rejected(grpc.StatusCode.DEADLINE_EXCEEDED, "deadline expired while queued")
+        finally:
+            self.waiting -= 1
+        self.counts["ran"] += 1
+
+    def release(self):
+        self.slots.release()
+
+    async def call(self, fn, request, remaining):
+        """fn(request) in the executor once admitted."""
+        await self.acquire(remaining)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, request)
+        finally:
+            self.release()
+
+class AsyncCodeExecServicer(codeexec_pb2_grpc.CodeExecServicer):
+    """
+    The same operations for grpc.aio. Nothing here prints per call unless verbose: a
+    blocking write to a slow terminal would stall every call on the loop.
+    """
+
+    def __init__(self, admission, verbose=False):
+        self.admission = admission
+        self.verbose = verbose
+
+    async def unary(self, op, request, context):
+        if self.verbose:
+            print(f"[AIO] Handling {op} from {context.peer()}")
+        try:
+            return await self.admission.call(functools.partial(run_op, op), request, context.time_remaining())
+        except Rejected as e:
+            await context.abort(e.code, e.details)
+        except TaskFailed as e:
+            await context.abort(TASK_STATUS[e.kind], str(e))
+
+    async def Add(self, request, context):
+        return await self.unary("add", request, context)
+
+    async def Sort(self, request, context):
+        return await self.unary("sort", request, context)
+
+    async def Upper(self, request, context):
+        return await self.unary("upper", request, context)
+
+    async def Reverse(self, request, context):
+        return await self.unary("reverse", request, context)
+
+    async def Execute(self, request_iterator, context):
+        # operations of one stream run concurrently and are answered as they finish; a
+        # refused operation gets an error response and the stream carries on
+        print(f"[AIO] Handling Execute stream from {context.peer()}")
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def one(request):
+            try:
+                response = await self.admission.call(execute, request, context.time_remaining())
+            except Rejected as e:
+                response = error_response(request.id, f"{e.code.name}: {e.details}")
+            async with write_lock:
+                await context.write(response)
+
+        async for request in request_iterator:
+            task = asyncio.create_task(one(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def SortStream(self, request_iterator, context):
+        # one admission slot for the whole sort; adding, sorting and merging run in the executor
+        from chunk_sort import ExternalSorter
+        print(f"[AIO] Handling SortStream from {context.peer()}")
+        try:
+            await self.admission.acquire(context.time_remaining())
+        except Rejected as e:
+            await context.abort(e.code, e.details)
+        loop = asyncio.get_running_loop()
+        executor = self.admission.executor
+        sorter = ExternalSorter(SORT_MEMORY, SPILL_DIR)
+        try:
+            try:
+                async for chunk in request_iterator:
+                    await loop.run_in_executor(executor, sorter.add, chunk.data)
+            except ValueError as e:
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+            chunks = sorter.sorted_chunks(SORT_CHUNK)
+            while (out := await loop.run_in_executor(executor, next_chunk, chunks)) is not None:
+                await context.write(out)
+            print(f"[AIO] SortStream done, {sorter.count} values, {len(sorter.runs)} runs spilled")
+        finally:
+            self.admission.release()
+            await loop.run_in_executor(executor, sorter.close)
+
+def add_servicer(servicer, server):
+    """
+    codeexec_pb2_grpc.add_CodeExecServicer_to_server, except that with a result cache the
+    unary methods and Execute hand back serialized responses, which go out as they are.
+    """
+    if CACHE is None:
+        codeexec_pb2_grpc.add_CodeExecServicer_to_server(servicer, server)
+        return
+    as_is = lambda body: body
+    handlers = {name: grpc.unary_unary_rpc_method_handler(getattr(servicer, name),
+                                                          request_deserializer=request_type.FromString,
+                                                          response_serializer=as_is)
+                for name, (_, request_type) in UNARY.items()}
+    handlers["Execute"] = grpc.stream_stream_rpc_method_handler(
+        servicer.Execute, request_deserializer=codeexec_pb2.ExecRequest.FromString, response_serializer=as_is)
+    handlers["SortStream"] = grpc.stream_stream_rpc_method_handler(
+        servicer.SortStream, request_deserializer=codeexec_pb2.FloatChunk.FromString,
+        response_serializer=codeexec_pb2.FloatChunk.SerializeToString)
+    server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler("CodeExec", handlers),))
+    server.add_registered_method_handlers("CodeExec", handlers)
+
+async def report(admission, every=5.0):
+    last = None
+    while True:
+        await asyncio.sleep(every)
+        counts = dict(admission.counts)
+        if counts != last:
+            print(f"[AIO] ran {counts['ran']}  shed {counts['shed']}  expired {counts['expired']}  "
+                  f"waiting {admission.waiting}")
+            last = counts
+
+async def serve_aio(port, max_concurrent, max_queue, verbose):
+    # Calls also queue inside gRPC before any handler sees them, so the same bound is set on
+    # the server itself: RPCs beyond it are refused with RESOURCE_EXHAUSTED on arrival.
+    server = grpc.aio.server(maximum_concurrent_rpcs=max_concurrent + max_queue)
+    admission = Admission(max_concurrent, max_queue)
+    add_servicer(AsyncCodeExecServicer(admission, verbose), server)
+    server.add_insecure_port(f'[::]:{port}')
+    print(f"🚀 gRPC asyncio Server running on port {port} "
+          f"(max {max_concurrent} running, {max_queue} queued)...")
+    await server.start()
+    reporter = asyncio.create_task(report(admission))
+    try:
+        await server.wait_for_termination()
+    finally:
+        reporter.cancel()
+
+def serve(port=50051, workers=10):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    add_servicer(CodeExecServicer(), server)
+    server.add_insecure_port(f'[::]:{port}')
+    print(f"🚀 gRPC Server running on port {port}...")
     server.start()
     server.wait_for_termination()
 
 if __name__ == '__main__':
-    serve()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--workers", type=int, default=10, help="thread pool size of the default server")
+    parser.add_argument("--aio", action="store_true", help="serve with grpc.aio and admission control")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="--aio: operations running at once")
+    parser.add_argument("--max-queue", type=int, default=32, help="--aio: operations waiting before shedding")
+    parser.add_argument("--verbose", action="store_true", help="--aio: log every call")
+    parser.add_argument("--sort-memory", type=int, default=SORT_MEMORY >> 20,
+                        help="MiB of values one SortStream holds before spilling sorted runs")
+    parser.add_argument("--spill-dir", default=SPILL_DIR, help="where SortStream spills runs")
+    parser.add_argument("--procs", type=int, default=os.cpu_count(), help="worker processes; 0 runs tasks in-server")
+    parser.add_argument("--task-cpu", type=int, default=5, help="CPU seconds per task")
+    parser.add_argument("--task-memory", type=int, default=512, help="MiB of address space per worker")
+    parser.add_argument("--task-timeout", type=float, default=30.0, help="wall-clock seconds per task")
+    parser.add_argument("--cache-mb", type=int, default=64, help="result cache size; 0 disables it")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds a cached result stays valid")
+    args = parser.parse_args()
+    SORT_MEMORY = args.sort_memory << 20
+    SPILL_DIR = args.spill_dir
+    if args.procs:
+        # started before gRPC, whose threads must not be forked
+        POOL = WorkerPool(args.procs, args.task_cpu, args.task_memory, args.task_timeout)
+        print(f"⚙️  {args.procs} worker processes ({args.task_cpu}s CPU, {args.task_memory} MiB per task)")
+    if args.cache_mb:
+        CACHE = ResultCache(args.cache_mb << 20, args.cache_ttl)
+        CACHE.report("GRPC")
+
+    if args.aio:
+        try:
+            asyncio.run(serve_aio(args.port, args.max_concurrent, args.max_queue, args.verbose))
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve(args.port, args.workers)
@@ -0,0 +1,91 @@
+# result_cache.py
+# Memoization of the remote-execution operations for rpc/rpc_server.py and grpc/grpc_server.py.
+# add, sort, reverse and uppercase are pure, so a call can be answered from an earlier one
+# with the same operation and arguments. Entries are keyed by the operation plus a hash of a
+# canonical encoding of the arguments (sorted-key compact JSON for XML-RPC parameters,
+# deterministic protobuf bytes for gRPC requests), and their values are the already-
+# serialized responses, so a hit skips the task, the worker pool and marshalling alike.
+#
+# Bounded by total bytes with least-recently-used eviction, plus an optional TTL. A single
+# response larger than 1/16 of the budget is not cached, so one huge sort cannot flush
+# everything else.
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+def canonical(args):
+    """A stable byte encoding of plain (JSON-like) arguments."""
+    return json.dumps(args, sort_keys=True, separators=(",", ":"), default=repr).encode()
+
+class ResultCache:
+    def __init__(self, max_bytes=64 << 20, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (body, expires or None), oldest first
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "too_large": 0}
+
+    def key(self, op, payload):
+        """Cache key of operation `op` on canonical argument bytes `payload`."""
+        return hashlib.blake2b(payload, digest_size=16, person=op.encode()[:16]).digest()
+
+    def get(self, key, miss=True):
+        """
+        The cached body, or None. miss=False leaves a miss uncounted, for a cheap first
+        lookup that falls back to another key.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counts["misses"] += miss
+                return None
+            body, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                self.drop(key)
+                self.counts["expired"] += 1
+                self.counts["misses"] += miss
+                return None
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes // 16:
+            with self.lock:
+                self.counts["too_large"] += 1
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (body, expires)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+                self.counts["evictions"] += 1
+
+    def drop(self, key):
+        body, _ = self.entries.pop(key)
+        self.size -= len(body)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return dict(self.counts, entries=len(self.entries), bytes=self.size,
+                        hit_rate=round(self.counts["hits"] / lookups, 3) if lookups else None)
+
+    def report(self, label, every=10.0):
+        """Print stats() every `every` seconds, when they changed, from a daemon thread."""
+        def loop():
+            last = None
+            while True:
+                time.sleep(every)
+                stats = self.stats()
+                if stats != last:
+                    print(f"[{label}] cache {stats}")
+                    last = stats
+        threading.Thread(target=loop, daemon=True).start()
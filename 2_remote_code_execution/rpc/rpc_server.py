@@ -1,14 +1,54 @@
 # rpc_server.py
+# python rpc_server.py                      tasks run in a pool of worker processes (one per core)
+# python rpc_server.py --procs 4 --task-cpu 5 --task-memory 512 --task-timeout 30
+# python rpc_server.py --procs 0            tasks run in the request threads, as before
+# python rpc_server.py --cache-mb 64 --cache-ttl 300
+#                                           repeated calls answered from a result cache (--cache-mb 0: off)
 from xmlrpc.server import SimpleXMLRPCServer
 from socketserver import ThreadingMixIn
+import argparse
+import os
+import sys
 import threading
+import xmlrpc.client
 
-class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
-    pass
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from worker_pool import TASKS, WorkerPool
+from result_cache import ResultCache, canonical
+
+POOL = None   # worker_pool.WorkerPool unless started with --procs 0
+CACHE = None  # result_cache.ResultCache unless started with --cache-mb 0
 
-print("🚀 RPC Remote Code Execution Server running on port 8000...")
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
 
-server = ThreadedXMLRPCServer(("localhost", 8000), allow_none=True)
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        # A repeated execute_task call is answered with the response marshalled the first
+        # time, without dispatching or marshalling it again. Faults are not cached.
+        # Responses are filed under the canonical key of the call and also under the raw
+        # request bytes, so a byte-identical request (the usual repeat) is answered without
+        # even parsing it (the same bytes object, though it counts twice against the budget).
+        dispatch = lambda: super(ThreadedXMLRPCServer, self)._marshaled_dispatch(data, dispatch_method, path)
+        if CACHE is None:
+            return dispatch()
+        raw_key = CACHE.key("xmlrpc", data)
+        body = CACHE.get(raw_key, miss=False)
+        if body is not None:
+            return body
+        try:
+            params, method = xmlrpc.client.loads(data, use_builtin_types=self.use_builtin_types)
+        except Exception:
+            return dispatch()
+        if method != "execute_task" or len(params) != 2 or params[0] not in TASKS:
+            return dispatch()
+        key = CACHE.key(params[0], canonical(params[1]))
+        body = CACHE.get(key)
+        if body is None:
+            body = dispatch()
+            if b"<fault>" in body[:100]:
+                return body
+            CACHE.put(key, body)
+        CACHE.put(raw_key, body)
+        return body
 
 # --------------------------------------
 # REMOTE EXECUTION FUNCTION (WITH THREAD PRINTS)
@@ -18,27 +58,49 @@ def execute_task(task_type, data):
     # Print current thread handling request
     print(f"[THREAD {threading.get_ident()}] Handling task: {task_type}")
 
-    if task_type == "add":
-        x, y = data
-        return x + y
+    if task_type not in TASKS:
+        return "❌ Unknown task"
 
-    elif task_type == "sort":
-        return sorted(data)
+    # a task that raises, breaks a limit or kills its worker raises TaskFailed here,
+    # which reaches the client as an XML-RPC fault
+    if POOL is not None:
+        return POOL.run(task_type, data)
+    return TASKS[task_type](data)
 
-    elif task_type == "reverse":
-        return data[::-1]
+def cache_stats():
+    return CACHE.stats() if CACHE is not None else None
 
-    elif task_type == "uppercase":
-        return data.upper()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--procs", type=int, default=os.cpu_count(), help="worker processes; 0 runs tasks in-thread")
+    parser.add_argument("--task-cpu", type=int, default=5, help="CPU seconds per task")
+    parser.add_argument("--task-memory", type=int, default=512, help="MiB of address space per worker")
+    parser.add_argument("--task-timeout", type=float, default=30.0, help="wall-clock seconds per task")
+    parser.add_argument("--cache-mb", type=int, default=64, help="result cache size; 0 disables it")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds a cached result stays valid")
+    args = parser.parse_args()
 
-    else:
-        return "❌ Unknown task"
+    if args.procs:
+        # before the server starts any threads
+        POOL = WorkerPool(args.procs, args.task_cpu, args.task_memory, args.task_timeout)
+        print(f"⚙️  {args.procs} worker processes ({args.task_cpu}s CPU, {args.task_memory} MiB per task)")
+
+    if args.cache_mb:
+        CACHE = ResultCache(args.cache_mb << 20, args.cache_ttl)
+        CACHE.report("RPC")
+
+    print(f"🚀 RPC Remote Code Execution Server running on port {args.port}...")
 
-server.register_function(execute_task, "execute_task")
+    server = ThreadedXMLRPCServer(("localhost", args.port), allow_none=True)
+    server.register_function(execute_task, "execute_task")
+    server.register_function(cache_stats, "cache_stats")
 
-try:
-    server.serve_forever()
-except KeyboardInterrupt:
-    print("\n🛑 Server stopping (Ctrl+C pressed)…")
-    server.server_close()
-    print("✅ Server closed cleanly.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Server stopping (Ctrl+C pressed)…")
+        server.server_close()
+        if POOL is not None:
+            POOL.close()
+        print("✅ Server closed cleanly.")
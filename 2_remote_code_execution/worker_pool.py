@@ -0,0 +1,191 @@
+# worker_pool.py
+# The remote-execution tasks, and a pool of pre-started worker processes that runs them for
+# rpc/rpc_server.py and grpc/grpc_server.py.
+#
+# Workers are started once and reused, so a task pays for a pipe round trip instead of an
+# interpreter start, and CPU-heavy tasks run on as many cores as there are workers instead of
+# queueing on the server's GIL. Each task runs under limits:
+#   cpu_seconds  RLIMIT_CPU, set per task relative to what the worker has used so far; the
+#                SIGXCPU it raises stops the task with an error and the worker carries on
+#   memory_mb    RLIMIT_AS for the whole worker; an allocation past it is a MemoryError
+#   timeout      wall clock, checked by the server; a worker that overruns it (stuck in C code,
+#                or asleep) is killed
+# A worker that dies or is killed only fails the task it was running; it is replaced at once.
+#
+# Workers come from a multiprocessing fork server started with the pool, so a replacement
+# is forked from a small single-threaded process, never from the (threaded, gRPC-holding)
+# server itself.
+
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+
+# --------------------------------------
+# TASKS
+# --------------------------------------
+def add(data):
+    x, y = data
+    return x + y
+
+def sort(data):
+    return sorted(data)
+
+def reverse(data):
+    return data[::-1]
+
+def uppercase(data):
+    return data.upper()
+
+TASKS = {"add": add, "sort": sort, "reverse": reverse, "uppercase": uppercase}
+
+# --------------------------------------
+# WORKER PROCESS
+# --------------------------------------
+class CpuLimitExceeded(Exception):
+    pass
+
+def on_sigxcpu(signum, frame):
+    raise CpuLimitExceeded()
+
+def cpu_used():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def worker_main(conn, cpu_seconds, memory_mb):
+    """Run (task_type, data) messages from `conn` until None; reply (ok, kind, value)."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is for the server, which stops us
+    signal.signal(signal.SIGXCPU, on_sigxcpu)
+    if memory_mb:
+        limit = memory_mb << 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        except MemoryError:
+            conn.send((False, "memory", f"task input too large for the {memory_mb} MiB memory limit"))
+            continue
+        if message is None:
+            return
+        task_type, data = message
+        try:
+            if cpu_seconds:
+                # RLIMIT_CPU counts the whole process, so the budget starts from what is used now
+                resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_used()) + 1 + cpu_seconds, cpu_hard))
+            reply = (True, None, TASKS[task_type](data))
+        except CpuLimitExceeded:
+            reply = (False, "cpu", f"cpu time limit of {cpu_seconds}s exceeded")
+        except MemoryError:
+            reply = (False, "memory", f"memory limit of {memory_mb} MiB exceeded")
+        except Exception as e:
+            reply = (False, "error", f"{type(e).__name__}: {e}")
+        finally:
+            if cpu_seconds:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_hard, cpu_hard))
+        try:
+            conn.send(reply)
+        except MemoryError:
+            conn.send((False, "memory", f"result too large for the {memory_mb} MiB memory limit"))
+
+# --------------------------------------
+# POOL
+# --------------------------------------
+class TaskFailed(Exception):
+    """
+    A task that did not produce a result. kind is "error" (the task raised), "unknown",
+    "cpu", "memory", "timeout" or "crash".
+    """
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+class Worker:
+    def __init__(self, ctx, cpu_seconds, memory_mb):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(child, cpu_seconds, memory_mb), daemon=True)
+        self.process.start()
+        child.close()
+
+class WorkerPool:
+    """`size` worker processes; run() hands a task to an idle one, waiting if all are busy."""
+
+    def __init__(self, size=None, cpu_seconds=5, memory_mb=512, timeout=30.0):
+        self.size = size or os.cpu_count()
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self.ctx = multiprocessing.get_context("forkserver")
+        self.ctx.set_forkserver_preload([__name__])
+        self.idle = queue.Queue()
+        self.counts = {"ran": 0, "failed": 0, "replaced": 0}
+        for _ in range(self.size):
+            self.idle.put(self.spawn())
+
+    def spawn(self):
+        return Worker(self.ctx, self.cpu_seconds, self.memory_mb)
+
+    def run(self, task_type, data):
+        """The task's result; raises TaskFailed if it raised, broke a limit or killed its worker."""
+        if task_type not in TASKS:
+            raise TaskFailed("unknown", f"unknown task {task_type!r}")
+        worker = self.idle.get()
+        reply = None
+        timed_out = False
+        try:
+            worker.conn.send((task_type, data))
+            if worker.conn.poll(self.timeout):
+                reply = worker.conn.recv()
+            else:
+                timed_out = True
+        except (EOFError, OSError):
+            pass
+        if reply is None:
+            # dead, or stuck past the timeout: either way it is not reused
+            error = self.retire(worker, timed_out)
+            self.idle.put(self.spawn())
+            self.counts["failed"] += 1
+            self.counts["replaced"] += 1
+            raise error
+        self.idle.put(worker)
+        ok, kind, value = reply
+        if not ok:
+            self.counts["failed"] += 1
+            raise TaskFailed(kind, value)
+        self.counts["ran"] += 1
+        return value
+
+    def retire(self, worker, timed_out):
+        """Kill `worker` if it still runs and explain what happened to its task."""
+        if not timed_out:
+            worker.process.join(1)  # its pipe closes a moment before it is reaped
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        if timed_out:
+            return TaskFailed("timeout", f"task took longer than {self.timeout}s; worker killed")
+        code = worker.process.exitcode
+        if code is not None and code < 0:
+            name = signal.Signals(-code).name
+            if -code == signal.SIGXCPU:
+                return TaskFailed("cpu", f"cpu time limit of {self.cpu_seconds}s exceeded (worker killed by {name})")
+            return TaskFailed("crash", f"worker killed by {name}")
+        return TaskFailed("crash", f"worker exited with status {code}")
+
+    def close(self):
+        """Stop the idle workers (the busy ones stop with the server, being daemons)."""
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(1)